@@ -22,17 +22,50 @@ https://acyclica.zendesk.com/hc/en-us/articles/360003033252-API-Guide
 
 import csv
 import glob
+import io
 import logging
 import os
 import os.path
 import requests
+import shutil
 import sys
+import tempfile
 import time
-from datetime import datetime, timedelta
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from dateutil import tz
 from tqdm import tqdm
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+TIME_ZONE = "US/Central"
+BIN_SECONDS = 900
+TIME_STRINGS = np.array(
+    ["{:0>2}:{:0>2}:00".format(h, m) for h in range(24) for m in (0, 15, 30, 45)]
+)
+TRAVEL_TIMES = ["Strengths", "Firsts", "Lasts", "Minimums", "Maximums"]
+MASTER_COLUMNS = ["DateTime", "Month", "Day", "DoW", "Date", "Time"] + TRAVEL_TIMES
+MISSING_SECONDS = np.iinfo(np.uint16).max
+COMPACT_DTYPE = np.dtype(
+    [("Bin", np.int32)] + [(column, np.uint16) for column in TRAVEL_TIMES]
+)
+QUERY_FOLDER = "AcyclicaData\\Query"
+HEALTH_COLUMN = "Strengths"
+BASELINE_MONTHS = 12
+BASELINE_MIN_COUNT = 4
+OUTLIER_Z = 3.0
+MIN_COVERAGE = 0.5
+LOCK_WAIT_SECONDS = 600
+REPLACE_ATTEMPTS = 10
 
 
 logging.basicConfig(
@@ -99,6 +132,22 @@ def base_url_creation():
     return apiURL
 
 
+def time_zone_setting():
+    """
+    Reads the local time zone used for downloads and formatting from an
+    optional csv file. Falls back to TIME_ZONE when the file is not present.
+
+    Returns:
+        timeZone (string): IANA name of the local time zone
+    """
+    tzFile = "TimeZone.csv"
+    try:
+        timeZone = open(tzFile, "r").readline().strip()
+    except FileNotFoundError:
+        timeZone = ""
+    return timeZone or TIME_ZONE
+
+
 def folder_creation(routeName):
     """
     Creates the folder structure for a route if there are no folders
@@ -122,6 +171,132 @@ def folder_creation(routeName):
     return routeFolder, downloadFolder
 
 
+@contextmanager
+def route_lock(routeFolder, routeName):
+    """
+    Holds an OS lock on a lock file in the route's folder while the route is
+    being updated so that two runs can never write to the same master at
+    once. The lock belongs to the open file handle, so the OS releases it
+    when the handle is closed or the process dies; there is no stale lock to
+    clean up and the lock file itself is left in place.
+
+    Args:
+        routeFolder (string): Folder containing all of a route's data
+        routeName (string): Name of the route being updated
+
+    Raises:
+        TimeoutError: Lock could not be acquired within LOCK_WAIT_SECONDS
+    """
+    lockFile = os.path.join(routeFolder, f"{routeName}.lock")
+    waitUntil = time.time() + LOCK_WAIT_SECONDS
+    with open(lockFile, "a+") as lockHandle:
+        while not lock_handle(lockHandle):
+            if time.time() > waitUntil:
+                lockErrorMsg = f"""
+        Route: {routeName} is locked by another process.
+        Lock file: {lockFile}
+        """
+                logging.error(lockErrorMsg)
+                raise TimeoutError(lockErrorMsg)
+            time.sleep(1)
+        try:
+            yield
+        finally:
+            unlock_handle(lockHandle)
+
+
+def lock_handle(lockHandle):
+    """
+    Tries to take an exclusive OS lock on an open file without waiting,
+    using msvcrt on Windows and fcntl elsewhere.
+
+    Args:
+        lockHandle (file): Open lock file
+
+    Returns:
+        bool: True when the lock was taken
+    """
+    try:
+        if os.name == "nt":
+            lockHandle.seek(0)
+            msvcrt.locking(lockHandle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(lockHandle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def unlock_handle(lockHandle):
+    """
+    Releases the OS lock taken by lock_handle.
+
+    Args:
+        lockHandle (file): Open lock file
+    """
+    if os.name == "nt":
+        lockHandle.seek(0)
+        msvcrt.locking(lockHandle.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(lockHandle.fileno(), fcntl.LOCK_UN)
+
+
+def fsync_replace(tempPath, finalPath):
+    """
+    Flushes a finished temp file to disk and renames it over the final path.
+    The rename is atomic, so a reader or a crash will only ever see the old
+    file or the complete new one. Windows refuses the rename while a reader
+    has the file open, so it is retried for a few seconds.
+
+    Args:
+        tempPath (string): Location of the fully written temp file
+        finalPath (string): Location the temp file will replace
+    """
+    with open(tempPath, "rb+") as f:
+        os.fsync(f.fileno())
+    for attempt in range(REPLACE_ATTEMPTS):
+        try:
+            os.replace(tempPath, finalPath)
+            break
+        except PermissionError:
+            if attempt == REPLACE_ATTEMPTS - 1:
+                raise
+            time.sleep(1)
+    fsync_folder(os.path.dirname(finalPath))
+
+
+def fsync_folder(folder):
+    """
+    Flushes a folder's entries to disk so a rename survives a power loss.
+    Windows does not allow folders to be opened, where the rename is already
+    durable, so this is skipped there.
+
+    Args:
+        folder (string): Location of the folder to flush
+    """
+    if os.name == "nt":
+        return
+    folderHandle = os.open(folder or ".", os.O_RDONLY)
+    try:
+        os.fsync(folderHandle)
+    finally:
+        os.close(folderHandle)
+
+
+def write_atomic(filePath, data):
+    """
+    Writes data to a temp file beside filePath and swaps it into place.
+
+    Args:
+        filePath (string): Location of the file to write
+        data (bytes): Full contents of the file
+    """
+    tempPath = f"{filePath}.tmp"
+    with open(tempPath, "wb") as f:
+        f.write(data)
+    fsync_replace(tempPath, filePath)
+
+
 def check_old_files(downloadFolder):
     """
     Checks downloadFolder to see if there are any files left over and deletes
@@ -154,14 +329,46 @@ def master_file_check(routeName, folderLocation):
     """
     masterFile = f"{folderLocation}\\{routeName} - Master.csv"
     if not os.path.isfile(masterFile):
-        with open(masterFile, "w") as newFile:
-            newFile.write(
-                "DateTime,Month,Day,DoW,Date,Time,Strengths,Firsts,Lasts,Minimums,Maximums\n2020-04-30 23:45:00,April,Thursday,30,2020-04-30,23:45:00,00:00:00,00:00:00,00:00:00,00:00:00,00:00:00\n"
-            )
+        write_atomic(
+            masterFile,
+            b"DateTime,Month,Day,DoW,Date,Time,Strengths,Firsts,Lasts,Minimums,Maximums\n2020-04-30 23:45:00,April,Thursday,30,2020-04-30,23:45:00,00:00:00,00:00:00,00:00:00,00:00:00,00:00:00\n",
+        )
         # TODO Need to move find date before this point so that we can populate a generic time line from 2 years ago so that get_last_date can have a reference for the beginning download.
     return masterFile
 
 
+def recover_master(masterFile):
+    """
+    Undoes an append that was interrupted by a crash. Before every append the
+    original size of the master is written to a journal file, and the journal
+    is only removed once the append is flushed to disk. A journal found here
+    means the append never finished, so the master is truncated back to its
+    original size and the missing time frames are downloaded again. Temp
+    files left by an interrupted rewrite are also removed; the master itself
+    is untouched by those.
+
+    Args:
+        masterFile (string): Location of the master file for the route
+    """
+    journalFile = f"{masterFile}.journal"
+    if os.path.isfile(journalFile):
+        with open(journalFile) as journal:
+            originalSize = journal.read().strip()
+        if originalSize.isdigit():
+            with open(masterFile, "rb+") as master:
+                master.truncate(int(originalSize))
+                os.fsync(master.fileno())
+            logging.warning(
+                f"Rolled back interrupted append to {masterFile} "
+                f"at {originalSize} bytes"
+            )
+        os.remove(journalFile)
+    for tempFile in (f"{masterFile}.tmp", f"{journalFile}.tmp"):
+        if os.path.isfile(tempFile):
+            logging.warning(f"Removed unfinished temp file {tempFile}")
+            os.remove(tempFile)
+
+
 def get_last_date(masterFile):
     """
     Reads the master .csv file for the route requested.
@@ -183,7 +390,28 @@ def get_last_date(masterFile):
     return lastDate
 
 
-def calc_time_interval(lastDate):
+def local_to_epoch(localDate, timeZone=TIME_ZONE):
+    """
+    Converts a naive local date and time into epoch seconds for the given
+    time zone, independent of the time zone of the computer running the
+    download. During the fall back hour the later, standard time, instance
+    is used so data is never downloaded twice. Times inside the spring
+    forward gap are moved forward to the first valid time.
+
+    Args:
+        localDate (datetime): Naive date and time in the local time zone
+        timeZone (string): IANA name of the local time zone
+
+    Returns:
+        epoch (int): Epoch time code for localDate
+    """
+    localStamp = pd.Timestamp(localDate).tz_localize(
+        timeZone, ambiguous=False, nonexistent="shift_forward"
+    )
+    return int(localStamp.timestamp())
+
+
+def calc_time_interval(lastDate, timeZone=TIME_ZONE):
     """
     Creates start and end times in epoch time stamps to be used in
     Acyclica's API.
@@ -191,15 +419,18 @@ def calc_time_interval(lastDate):
     Args:
         lastDate (datetime): 15 minutes after the last date found in the
         route's master file. This is the begining time for downloads.
+        timeZone (string): IANA name of the local time zone
 
     Returns:
         fromDateEpoch (int): Epoch time code for the begining datetime.
         toDate (datetime): Date and time for the end of the download.
         toDateEpoch (int): Epoch time code fo the ending datetime.
     """
-    fromDateEpoch = int((lastDate + timedelta(minutes=15)).timestamp())
-    toDate = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
-    toDateEpoch = int(toDate.timestamp())
+    fromDateEpoch = local_to_epoch(lastDate, timeZone) + BIN_SECONDS
+    toDate = datetime.now(tz.gettz(timeZone)).replace(
+        hour=0, minute=0, second=0, microsecond=0, tzinfo=None
+    )
+    toDateEpoch = local_to_epoch(toDate, timeZone)
     return fromDateEpoch, toDate, toDateEpoch
 
 
@@ -359,18 +590,192 @@ def file_fill(df, fromDateEpoch, toDateEpoch):
     return df
 
 
-def format_new_files(mergedFilePath, fromDateEpoch, toDateEpoch):
+@lru_cache(maxsize=None)
+def calendar_year(year, timeZone=TIME_ZONE):
+    """
+    Builds the local calendar fields for every 15 minute UTC bin in a UTC
+    year. Bins are numbered as epoch seconds // BIN_SECONDS. Converting whole
+    bins keeps daylight savings exact: the fall back hour appears twice with
+    the same local strings and the spring forward hour never appears. Each
+    year is only built once per time zone.
+
+    Args:
+        year (int): UTC year to build
+        timeZone (string): IANA name of the local time zone
+
+    Returns:
+        calendar (dataframe): DateTime, Month, Day, DoW, Date and Time as in
+        the master file, plus DateKey (yyyymmdd) and Slot (15 minute period
+        of the local day) as integers, indexed by bin
+    """
+    firstBin = int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp())
+    lastBin = int(datetime(year + 1, 1, 1, tzinfo=timezone.utc).timestamp())
+    bins = np.arange(firstBin // BIN_SECONDS, lastBin // BIN_SECONDS)
+    local = pd.to_datetime(bins * BIN_SECONDS, unit="s", utc=True).tz_convert(
+        timeZone
+    )
+    localDays = local.tz_localize(None).normalize()
+    dayCodes, uniqueDays = pd.factorize(localDays)
+    dates = np.asarray(uniqueDays.strftime("%Y-%m-%d"), dtype=object)[dayCodes]
+    times = TIME_STRINGS[(local.hour * 60 + local.minute) // 15]
+    calendar = pd.DataFrame(
+        {
+            "DateTime": dates + " " + times.astype(object),
+            "Month": np.asarray(local.month_name(), dtype=object),
+            "Day": np.asarray(local.day_name(), dtype=object),
+            "DoW": (np.asarray(local.dayofweek) + 1) % 7 + 1,
+            "Date": dates,
+            "Time": times,
+            "DateKey": (
+                local.year * 10000 + local.month * 100 + local.day
+            ).values.astype(np.int32),
+            "Slot": ((local.hour * 60 + local.minute) // 15).values.astype(
+                np.int8
+            ),
+        },
+        index=bins,
+    )
+    return calendar
+
+
+def calendar_lookup(bins, timeZone=TIME_ZONE):
+    """
+    Looks up the local calendar fields for an array of 15 minute UTC bins.
+
+    Args:
+        bins (array): Bin numbers, epoch seconds // BIN_SECONDS
+        timeZone (string): IANA name of the local time zone
+
+    Returns:
+        calendar (dataframe): Calendar fields in the same order as bins
+    """
+    bins = np.asarray(bins, dtype=np.int64)
+    if len(bins) == 0:
+        return calendar_year(1970, timeZone).iloc[0:0].copy()
+    years = pd.to_datetime(bins * BIN_SECONDS, unit="s").year.unique()
+    calendar = pd.concat(calendar_year(int(y), timeZone) for y in years)
+    return calendar.loc[bins].reset_index(drop=True)
+
+
+def compact_seconds(seconds):
+    """
+    Packs travel times in whole seconds into uint16, with MISSING_SECONDS in
+    place of NaN.
+
+    Args:
+        seconds (array): Travel times in seconds, NaN where missing
+
+    Returns:
+        compact (array): Travel times as uint16
+    """
+    seconds = np.asarray(seconds, dtype=np.float64)
+    compact = np.full(len(seconds), MISSING_SECONDS, dtype=np.uint16)
+    present = ~np.isnan(seconds)
+    compact[present] = np.clip(seconds[present], 0, MISSING_SECONDS - 1)
+    return compact
+
+
+def expand_seconds(compact):
+    """
+    Unpacks uint16 travel times into float32 seconds with NaN where missing.
+
+    Args:
+        compact (array): Travel times as uint16
+
+    Returns:
+        seconds (array): Travel times in seconds as float32
+    """
+    seconds = compact.astype(np.float32)
+    seconds[compact == MISSING_SECONDS] = np.nan
+    return seconds
+
+
+def compact_rows(bins, travelTimes):
+    """
+    Builds the compact in memory form of 15 minute travel times: a NumPy
+    structured array of COMPACT_DTYPE holding the int32 UTC bin and a uint16
+    number of seconds for each travel time. It takes a small fraction of the
+    memory of the master file's strings, which are only produced by
+    master_frame when writing csv files.
+
+    Args:
+        bins (array): Bin numbers, epoch seconds // BIN_SECONDS
+        travelTimes (dict): Travel times in seconds for each of TRAVEL_TIMES,
+        NaN where missing
+
+    Returns:
+        compact (array): Structured array of COMPACT_DTYPE
+    """
+    compact = np.empty(len(bins), dtype=COMPACT_DTYPE)
+    compact["Bin"] = bins
+    for column in TRAVEL_TIMES:
+        compact[column] = compact_seconds(travelTimes[column])
+    return compact
+
+
+@lru_cache(maxsize=None)
+def duration_strings():
+    """
+    Builds the hh:mm:ss string for every uint16 number of seconds using
+    timedelta_h_m_s, so csv files are written exactly as before with a single
+    array lookup. MISSING_SECONDS is written as NaN was, "nan:nan:nan".
+
+    Returns:
+        strings (array): hh:mm:ss strings indexed by seconds
+    """
+    strings = np.array(
+        [
+            timedelta_h_m_s(timedelta(seconds=s))
+            for s in range(MISSING_SECONDS + 1)
+        ],
+        dtype=object,
+    )
+    strings[MISSING_SECONDS] = "nan:nan:nan"
+    return strings
+
+
+def master_frame(compact, timeZone=TIME_ZONE):
+    """
+    Converts compact rows into the string columns of the master file for
+    writing to csv.
+
+    Args:
+        compact (array): Structured array of COMPACT_DTYPE
+        timeZone (string): IANA name of the local time zone
+
+    Returns:
+        df (dataframe): Rows in the master file format
+    """
+    df = calendar_lookup(compact["Bin"], timeZone)
+    strings = duration_strings()
+    for column in TRAVEL_TIMES:
+        df[column] = strings[compact[column]]
+    return df[MASTER_COLUMNS]
+
+
+def format_new_files(
+    mergedFilePath, fromDateEpoch, toDateEpoch, timeZone=TIME_ZONE
+):
     """
     Formats the combined file for use in Excel
     -Removes lines containing 0s (missing data) as to not influence averages
     -Averages based on 15min time periods
+    -Fills every 15min period from fromDate up to toDate, leaving periods
+     without data blank, so windows already known to be empty are never
+     downloaded again
     -Converts ms into h:mm:ss formatting
     -Splits datetime into multiple columns for different Excel formulas
+     using the precomputed local calendar
 
     Args:
         mergedFilePath (Epoch): Location of the downloaded merged data
         fromDateEpoch (int): Epoch version of the fromDate
         toDateEpoch (int): Epoch version of the toDate
+        timeZone (string): IANA name of the local time zone
+
+    Returns:
+        compact (array): The formatted rows as a structured array of
+        COMPACT_DTYPE
     """
     df = pd.read_csv(mergedFilePath)
     if df.empty == True:
@@ -379,64 +784,52 @@ def format_new_files(mergedFilePath, fromDateEpoch, toDateEpoch):
     df = df.replace(0, np.nan)
     df = df.resample("15min", base=0, on="Timestamp").mean()
     # TODO possible interpolate over x amount of Nan rows? Max of 1-3?
-    df = df.reset_index()
-    df["Timestamp"] = (
-        df["Timestamp"].dt.tz_localize("utc").dt.tz_convert("US/Central")
-    )
-    df["Timestamp"] = pd.to_datetime(df["Timestamp"], unit="ms").apply(
-        "{:%B %A %w %Y-%m-%d %H:%M:%S}".format
-    )
-    df.Strengths = pd.to_timedelta(df.Strengths, unit="ms").apply(
-        timedelta_h_m_s
-    )
-    df.Firsts = pd.to_timedelta(df.Firsts, unit="ms").apply(timedelta_h_m_s)
-    df.Lasts = pd.to_timedelta(df.Lasts, unit="ms").apply(timedelta_h_m_s)
-    df.Minimums = pd.to_timedelta(df.Minimums, unit="ms").apply(timedelta_h_m_s)
-    df.Maximums = pd.to_timedelta(df.Maximums, unit="ms").apply(timedelta_h_m_s)
-    df["Month"] = df.Timestamp.str.split(" ").str.get(0)
-    df["Day"] = df.Timestamp.str.split(" ").str.get(1)
-    df["DoW"] = df.Timestamp.str.split(" ").str.get(2)
-    df["Date"] = df.Timestamp.str.split(" ").str.get(3)
-    df["Time"] = df.Timestamp.str.split(" ").str.get(4)
-    df["DoW"] = df["DoW"].astype(int)
-    df.DoW = df.DoW + 1
-    df["DateTime"] = df.Date + " " + df.Time
-    df["Date"] = pd.to_datetime(df["Date"]).apply("{:%Y-%m-%d}".format)
-    df["DateTime"] = pd.to_datetime(df["DateTime"]).apply(
-        "{:%Y-%m-%d %H:%M:%S}".format
-    )
-    del df["Timestamp"]
-    df = df[
-        [
-            "DateTime",
-            "Month",
-            "Day",
-            "DoW",
-            "Date",
-            "Time",
-            "Strengths",
-            "Firsts",
-            "Lasts",
-            "Minimums",
-            "Maximums",
-        ]
-    ]
-    df.to_csv(mergedFilePath, index=False)
+    bins = np.arange(fromDateEpoch // BIN_SECONDS, toDateEpoch // BIN_SECONDS)
+    df = df.reindex(pd.to_datetime(bins * BIN_SECONDS, unit="s"))
+    travelTimes = {
+        column: pd.to_timedelta(df[column], unit="ms").dt.seconds
+        for column in TRAVEL_TIMES
+    }
+    compact = compact_rows(bins, travelTimes)
+    master_frame(compact, timeZone).to_csv(mergedFilePath, index=False)
+    return compact
 
 
 def append_new_timeframes(mergedFilePath, masterFile):
     """
-    Appends the new temp file to the master file.
+    Appends the new temp file to the master file. The master's size is
+    journaled first so recover_master can roll back a partial append, then
+    the append is flushed to disk and its size verified before the journal
+    and temp file are removed. Only the new rows are written, the master is
+    never copied.
 
     Args:
         mergedFilePath (string): Location of the downloaded merged data
         masterFile (string): Location of the master file for the route
+
+    Raises:
+        IOError: Master file did not grow by the size of the new data
     """
+    journalFile = f"{masterFile}.journal"
+    originalSize = os.path.getsize(masterFile)
+    write_atomic(journalFile, str(originalSize).encode())
+    with open(mergedFilePath, "rb") as f:
+        next(f)
+        newData = f.read()
     with open(masterFile, "ab") as fout:
-        with open(mergedFilePath, "rb") as f:
-            next(f)
-            fout.write(f.read())
-    # TODO put a check in to make sure the files were appended befor deleting
+        fout.write(newData)
+        fout.flush()
+        os.fsync(fout.fileno())
+    if os.path.getsize(masterFile) != originalSize + len(newData):
+        appendErrorMsg = f"""
+        Append to {masterFile} could not be verified.
+        Expected {originalSize + len(newData)} bytes.
+        Found {os.path.getsize(masterFile)} bytes.
+        """
+        logging.error(appendErrorMsg)
+        recover_master(masterFile)
+        raise IOError(appendErrorMsg)
+    os.remove(journalFile)
     delete_temp_file(mergedFilePath)
 
 
@@ -450,62 +843,812 @@ def delete_temp_file(mergedFilePath):
     os.remove(mergedFilePath)
 
 
-def delete_old_timeframes(toDate, masterFile):
+def retention_cutoff(toDate):
     """
-    Reads the master file and deletes entries older than 2 years
+    Finds the oldest date and time kept in the master file, 2 years before
+    the last downloaded data.
 
     Args:
         toDate (datetime): Date of last downloaded data
-        masterFile (string): Location of the master file for the route
+
+    Returns:
+        deleteToDateString (string): Cutoff in the master's DateTime format
     """
     deleteYear = toDate.strftime("%Y")
     deleteToYear = int(deleteYear) - 2
     deleteToDate = toDate.replace(year=deleteToYear)
     deleteToDateString = datetime.strftime(deleteToDate, "%Y-%m-%d %H:%M:%S")
-    df = pd.read_csv(masterFile)
-    df.drop(df[df["DateTime"] < deleteToDateString].index, inplace=True)
-    df.to_csv(masterFile, index=False)
+    return deleteToDateString
+
+
+def delete_old_timeframes(toDate, masterFile, routeFolder):
+    """
+    Moves whole months older than 2 years out of the master file and into
+    the route's archive. Only the first row is read on most nights; the
+    master is rewritten once a month, when its oldest month has fully
+    expired, so it holds between 2 years and 2 years and a month of data.
+    The expired lines at the top are parsed and the rest of the file is
+    copied as raw bytes into a temp file that is renamed over the original.
+    The archive is written before the rename, so a crash leaves either the
+    old or the new master, never a partial one, and no rows are lost.
+
+    Args:
+        toDate (datetime): Date of last downloaded data
+        masterFile (string): Location of the master file for the route
+        routeFolder (string): Folder containing all of a route's data
+    """
+    cutoffMonth = retention_cutoff(toDate)[:7].encode()
+    archiveFolder = os.path.join(routeFolder, "Archive")
+    tempPath = f"{masterFile}.tmp"
+    with open(masterFile, "rb") as master:
+        header = master.readline()
+        line = master.readline()
+        if not line or line[:7] >= cutoffMonth:
+            return
+        expiredLines = []
+        while line and line[:7] < cutoffMonth:
+            expiredLines.append(line)
+            line = master.readline()
+        archive_timeframes(header + b"".join(expiredLines), archiveFolder)
+        with open(tempPath, "wb") as temp:
+            temp.write(header)
+            temp.write(line)
+            shutil.copyfileobj(master, temp)
+    fsync_replace(tempPath, masterFile)
+
+
+def archive_timeframes(expiredData, archiveFolder):
+    """
+    Writes expired master rows to zstd compressed parquet files, one per
+    month, e.g. Archive\\2018\\11\\2018-11.parquet. Only whole months are
+    expired, so each month file is written once. Repeating a night that
+    crashed before the master was trimmed rewrites the same files.
+
+    Args:
+        expiredData (bytes): Master header and expired rows in csv format
+        archiveFolder (string): Location of the route's archive
+    """
+    df = pd.read_csv(io.BytesIO(expiredData))
+    for monthKey, monthRows in df.groupby(df["DateTime"].str[:7]):
+        year, month = monthKey.split("-")
+        monthFolder = os.path.join(archiveFolder, year, month)
+        if not os.path.isdir(monthFolder):
+            os.makedirs(monthFolder)
+        monthFile = os.path.join(monthFolder, f"{monthKey}.parquet")
+        tempPath = f"{monthFile}.tmp"
+        monthRows.to_parquet(tempPath, compression="zstd", index=False)
+        fsync_replace(tempPath, monthFile)
+    logging.info(f"Archived {len(df)} rows to {archiveFolder}")
+
+
+def read_master_snapshot(masterFile):
+    """
+    Reads the master file's complete lines in one pass. A nightly append may
+    be writing to the end of the file, so any partial last line is dropped.
+
+    Args:
+        masterFile (string): Location of the master file for the route
+
+    Returns:
+        df (dataframe): Rows of the master file, oldest first
+    """
+    with open(masterFile, "rb") as master:
+        data = master.read()
+    data = data[: data.rfind(b"\n") + 1]
+    return pd.read_csv(io.BytesIO(data))
+
+
+def load_timeframes(routeName, startDate, endDate):
+    """
+    Reads a route's rows between two local dates and times from both the
+    archive and the master file, so callers do not need to know where the
+    data is stored. No lock is taken, so readers never wait on each other
+    or on the nightly update. The master is read first and only archive
+    months before its first row are used. Months are archived before the
+    master is trimmed, so whichever master is read, every row appears once.
+
+    Args:
+        routeName (string): Name of the route to read
+        startDate (string): First DateTime to include, "yyyy-mm-dd hh:mm:ss"
+        endDate (string): Last DateTime to include, "yyyy-mm-dd hh:mm:ss"
+
+    Returns:
+        df (dataframe): Rows in the master file format, oldest first
+    """
+    routeFolder = f"AcyclicaData\\{routeName}"
+    archiveFolder = os.path.join(routeFolder, "Archive")
+    masterFile = f"{routeFolder}\\{routeName} - Master.csv"
+    masterRows = None
+    masterMonth = "9999-99"
+    if os.path.isfile(masterFile):
+        with open(masterFile) as master:
+            next(master)
+            masterMonth = master.readline()[:19] or masterMonth
+        if masterMonth <= endDate:
+            masterRows = read_master_snapshot(masterFile)
+            if len(masterRows):
+                masterMonth = masterRows["DateTime"].iloc[0]
+        masterMonth = masterMonth[:7]
+    frames = []
+    monthFiles = glob.glob(os.path.join(archiveFolder, "*", "*", "*.parquet"))
+    for monthFile in sorted(monthFiles):
+        monthKey = os.path.basename(monthFile)[:7]
+        if startDate[:7] <= monthKey <= endDate[:7] and monthKey < masterMonth:
+            frames.append(pd.read_parquet(monthFile))
+    if masterRows is not None and len(masterRows):
+        frames.append(masterRows)
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    inRange = (df["DateTime"] >= startDate) & (df["DateTime"] <= endDate)
+    return df[inRange].reset_index(drop=True)
+
+
+def duration_seconds(durations):
+    """
+    Converts travel times in hh:mm:ss format back to seconds. Minutes past 59
+    written by timedelta_h_m_s are folded into the hour. Blank or zero
+    travel times become NaN, matching the missing data in format_new_files.
+
+    Args:
+        durations (series): Travel times in hh:mm:ss format
+
+    Returns:
+        seconds (array): Travel times in seconds as float32
+    """
+    parts = durations.astype(str).str.split(":", expand=True)
+    parts = parts.apply(pd.to_numeric, errors="coerce")
+    seconds = parts[0] * 3600 + (parts[1] % 60) * 60 + parts[2]
+    return seconds.replace(0, np.nan).values.astype(np.float32)
+
+
+def compact_from_master(df, timeZone=TIME_ZONE):
+    """
+    Converts rows in the master file format into compact rows. The UTC bin
+    of each row is found by matching its local DateTime against the
+    calendar, using the order of repeated DateTimes to tell the two fall back
+    hours apart. Rows with no match, such as a DateTime inside the skipped
+    spring forward hour or a third copy of a fall back time, are dropped
+    and logged.
+
+    Args:
+        df (dataframe): Rows in the master file format, oldest first
+        timeZone (string): IANA name of the local time zone
+
+    Returns:
+        compact (array): Structured array of COMPACT_DTYPE
+    """
+    years = df["Date"].str[:4].astype(int)
+    years = range(years.min() - 1, years.max() + 2)
+    calendar = pd.concat(calendar_year(y, timeZone) for y in years)
+    calendar = pd.DataFrame(
+        {
+            "DateTime": calendar["DateTime"].values,
+            "Occurrence": calendar.groupby("DateTime").cumcount().values,
+            "Bin": calendar.index.values.astype(np.int32),
+        }
+    )
+    keys = pd.DataFrame(
+        {
+            "DateTime": df["DateTime"].values,
+            "Occurrence": df.groupby("DateTime").cumcount().values,
+        }
+    )
+    bins = keys.merge(calendar, how="left", on=["DateTime", "Occurrence"])
+    matched = bins["Bin"].notna().values
+    if not matched.all():
+        unmatched = df["DateTime"].values[~matched]
+        logging.warning(
+            f"Dropped {len(unmatched)} rows with no matching local time: "
+            f"{', '.join(map(str, unmatched[:10]))}"
+        )
+    travelTimes = {
+        column: duration_seconds(df[column])[matched] for column in TRAVEL_TIMES
+    }
+    return compact_rows(bins["Bin"].values[matched], travelTimes)
+
+
+def read_master_compact(masterFile, timeZone=TIME_ZONE):
+    """
+    Reads a master file into compact rows.
+
+    Args:
+        masterFile (string): Location of the master file for the route
+        timeZone (string): IANA name of the local time zone
+
+    Returns:
+        compact (array): Structured array of COMPACT_DTYPE
+    """
+    df = pd.read_csv(masterFile, usecols=["DateTime", "Date"] + TRAVEL_TIMES)
+    return compact_from_master(df, timeZone)
+
+
+def query_rows(routeName, compact, timeZone=TIME_ZONE):
+    """
+    Converts compact rows into the rows of the query store.
+
+    Args:
+        routeName (string): Name of the route the rows belong to
+        compact (array): Structured array of COMPACT_DTYPE
+        timeZone (string): IANA name of the local time zone
+
+    Returns:
+        rows (dataframe): Route, Bin, Date (yyyymmdd), DoW, Slot (15 minute
+        period of the local day) and travel times in seconds
+    """
+    calendar = calendar_lookup(compact["Bin"], timeZone)
+    rows = pd.DataFrame(
+        {
+            "Route": routeName,
+            "Bin": compact["Bin"],
+            "Date": calendar["DateKey"].values,
+            "DoW": calendar["DoW"].values.astype(np.int8),
+            "Slot": calendar["Slot"].values,
+        }
+    )
+    for column in TRAVEL_TIMES:
+        rows[column] = expand_seconds(compact[column])
+    return rows
+
+
+def summary_rows(df, columns=TRAVEL_TIMES):
+    """
+    Pre-aggregates query store rows into the sum, count and sum of squares
+    of each travel time for every route, day of the week and 15 minute period
+    of the day. Means over whole months can be answered from these without
+    reading the individual 15 minute rows, and standard deviations for the
+    health check baseline.
+
+    Args:
+        df (dataframe): Rows from query_rows
+        columns (list): Travel times to summarize
+
+    Returns:
+        summary (dataframe): Route, DoW, Slot and a Sum, Count and Squares
+        column for each travel time
+    """
+    columns = list(columns)
+    values = df[columns].astype(np.float64)
+    squares = (values ** 2).add_suffix(" Squares")
+    keys = [df["Route"], df["DoW"], df["Slot"]]
+    sums = values.groupby(keys).sum().add_suffix(" Sum")
+    counts = values.groupby(keys).count().astype(np.int32).add_suffix(" Count")
+    return sums.join(counts).join(squares.groupby(keys).sum()).reset_index()
+
+
+def route_baselines(routeNames, lastMonth, queryFolder=QUERY_FOLDER):
+    """
+    Builds each route's normal travel time for each day of the week and 15
+    minute period of the day from the query store summaries of the
+    BASELINE_MONTHS months up to lastMonth. The summaries are read once for
+    all routes and totalled in a single grouped pass. Periods with fewer
+    than BASELINE_MIN_COUNT values have no baseline.
+
+    Args:
+        routeNames (list): Names of the routes
+        lastMonth (int): Latest month to include, yyyymm
+        queryFolder (string): Location of the query store
+
+    Returns:
+        baselines (dict): (mean, std) for each route name. mean holds the
+        mean HEALTH_COLUMN seconds indexed by DoW * 96 + Slot, NaN where
+        there is no baseline, and std the standard deviation in the same
+        layout.
+    """
+    columns = [
+        f"{HEALTH_COLUMN} {stat}" for stat in ("Sum", "Count", "Squares")
+    ]
+    summaryFiles = sorted(
+        glob.glob(os.path.join(queryFolder, "Summary", "*.parquet"))
+    )
+    summaryFiles = [
+        f
+        for f in summaryFiles
+        if int(os.path.basename(f)[:6]) <= lastMonth
+        and columns[2] in pq.ParquetFile(f).schema.names
+    ][-BASELINE_MONTHS:]
+    routeNames = list(routeNames)
+    totals = np.zeros((3, len(routeNames), 8 * 96))
+    if summaryFiles:
+        summary = pd.concat(
+            pd.read_parquet(f, columns=["Route", "DoW", "Slot"] + columns)
+            for f in summaryFiles
+        )
+        routeKeys = pd.Index(routeNames).get_indexer(summary["Route"])
+        inRoutes = routeKeys >= 0
+        keys = routeKeys * (8 * 96) + summary["DoW"].values.astype(int) * 96
+        keys = (keys + summary["Slot"].values)[inRoutes]
+        for i, column in enumerate(columns):
+            totals[i] = np.bincount(
+                keys,
+                weights=summary[column].values[inRoutes],
+                minlength=totals[i].size,
+            ).reshape(totals[i].shape)
+    sums, counts, squares = totals
+    counts = np.where(counts >= BASELINE_MIN_COUNT, counts, np.nan)
+    with np.errstate(invalid="ignore"):
+        mean = sums / counts
+        std = np.sqrt(np.maximum(squares / counts - mean ** 2, 0))
+    return {
+        routeName: (mean[i], std[i]) for i, routeName in enumerate(routeNames)
+    }
+
+
+def route_health(compact, mean, std, timeZone=TIME_ZONE):
+    """
+    Checks the data quality of newly formatted rows in one vectorized pass
+    over HEALTH_COLUMN: how many periods have data, runs of consecutive
+    periods without data, and values more than OUTLIER_Z standard deviations
+    from the route's baseline for that day of the week and time of day.
+
+    Args:
+        compact (array): Structured array of COMPACT_DTYPE, one row for every
+        15 minute period in the window
+        mean (array): Baseline means from route_baselines
+        std (array): Baseline standard deviations from route_baselines
+        timeZone (string): IANA name of the local time zone
+
+    Returns:
+        report (dict): One row of the route's health report
+    """
+    calendar = calendar_lookup(compact["Bin"], timeZone)
+    seconds = expand_seconds(compact[HEALTH_COLUMN])
+    missing = np.isnan(seconds)
+    edges = np.diff(np.concatenate(([0], missing.astype(np.int8), [0])))
+    gapLengths = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+    keys = calendar["DoW"].values * 96 + calendar["Slot"].values
+    with np.errstate(divide="ignore", invalid="ignore"):
+        zScores = np.abs(seconds - mean[keys]) / std[keys]
+    zScores = zScores[np.isfinite(zScores)]
+    report = {
+        "From": calendar["DateTime"].iloc[0] if len(compact) else "",
+        "To": calendar["DateTime"].iloc[-1] if len(compact) else "",
+        "Periods": len(compact),
+        "Coverage": round(1 - missing.mean(), 3) if len(compact) else 0.0,
+        "Gaps": len(gapLengths),
+        "Longest Gap": int(gapLengths.max()) if len(gapLengths) else 0,
+        "Outliers": int((zScores > OUTLIER_Z).sum()),
+        "Max Z": round(float(zScores.max()), 2) if len(zScores) else 0.0,
+    }
+    return report
+
+
+def check_route_health(
+    routeName, routeFolder, compact, baseline, timeZone=TIME_ZONE
+):
+    """
+    Runs the health check on a route's new rows and records the result as
+    one row in the route's health report, e.g. "NB Main Avenue - Health.csv".
+    A row for the same window from an interrupted run is replaced. Low
+    coverage and outliers are also logged so a dead detector is noticed
+    before anyone opens the data.
+
+    Args:
+        routeName (string): Name of the route
+        routeFolder (string): Folder containing all of a route's data
+        compact (array): Structured array of COMPACT_DTYPE
+        baseline (tuple): The route's (mean, std) from route_baselines
+        timeZone (string): IANA name of the local time zone
+    """
+    if len(compact) == 0:
+        return
+    report = route_health(compact, *baseline, timeZone)
+    report = dict(
+        Checked=datetime.now().strftime("%Y-%m-%d %H:%M:%S"), **report
+    )
+    healthFile = os.path.join(routeFolder, f"{routeName} - Health.csv")
+    health = pd.DataFrame([report], columns=list(report))
+    if os.path.isfile(healthFile):
+        previous = pd.read_csv(healthFile, dtype={"From": str})
+        previous = previous[previous["From"] != report["From"]]
+        health = pd.concat([previous, health], ignore_index=True)
+    write_atomic(healthFile, health.to_csv(index=False).encode())
+    if report["Coverage"] < MIN_COVERAGE:
+        logging.warning(
+            f"{routeName} has data for {report['Coverage']:.0%} of "
+            f"{report['From']} to {report['To']}, longest gap "
+            f"{report['Longest Gap']} periods"
+        )
+    if report["Outliers"]:
+        logging.warning(
+            f"{routeName} has {report['Outliers']} outliers from "
+            f"{report['From']} to {report['To']}, max z {report['Max Z']}"
+        )
+
+
+def write_store_file(df, storeFile, groupByRoute=True):
+    """
+    Writes a query store file through a temp file and rename. With
+    groupByRoute each route is written as its own row group, so the route
+    statistics in the file's metadata act as an index and a query only reads
+    the row groups of the routes it asks for. Small files are faster to read
+    as a single row group.
+
+    Args:
+        df (dataframe): Rows to write, sorted by Route
+        storeFile (string): Location of the parquet file
+        groupByRoute (bool): Write one row group per route
+    """
+    tempPath = f"{storeFile}.tmp"
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if groupByRoute:
+        writer = pq.ParquetWriter(tempPath, table.schema, compression="zstd")
+        try:
+            for _, routeRows in df.groupby("Route", sort=True):
+                writer.write_table(
+                    pa.Table.from_pandas(
+                        routeRows, table.schema, preserve_index=False
+                    )
+                )
+        finally:
+            writer.close()
+    else:
+        pq.write_table(table, tempPath, compression="zstd")
+    fsync_replace(tempPath, storeFile)
+
+
+def store_query_rows(frames, queryFolder=QUERY_FOLDER):
+    """
+    Adds rows to the query store. Each local month has a file of 15 minute
+    rows for every route sorted by Route and Bin, e.g. Query\\202003.parquet,
+    and a file of pre-aggregated rows from summary_rows, e.g.
+    Query\\Summary\\202003.parquet. Rows already stored for the same route
+    and bin are replaced, so storing the same rows twice is harmless. Only
+    the months touched are rewritten, while holding the store's lock.
+
+    Args:
+        frames (list): Dataframes of rows from query_rows
+        queryFolder (string): Location of the query store
+    """
+    frames = [f for f in frames if f is not None and len(f)]
+    if not frames:
+        return
+    summaryFolder = os.path.join(queryFolder, "Summary")
+    if not os.path.isdir(summaryFolder):
+        os.makedirs(summaryFolder)
+    newRows = pd.concat(frames, ignore_index=True)
+    with route_lock(queryFolder, "Query"):
+        for monthKey, monthRows in newRows.groupby(newRows["Date"] // 100):
+            monthFile = os.path.join(queryFolder, f"{monthKey}.parquet")
+            if os.path.isfile(monthFile):
+                stored = pd.read_parquet(monthFile)
+                replaced = pd.MultiIndex.from_arrays(
+                    [stored["Route"], stored["Bin"]]
+                ).isin(
+                    pd.MultiIndex.from_arrays(
+                        [monthRows["Route"], monthRows["Bin"]]
+                    )
+                )
+                monthRows = pd.concat(
+                    [stored[~replaced], monthRows], ignore_index=True
+                )
+            monthRows = monthRows.sort_values(["Route", "Bin"])
+            write_store_file(monthRows, monthFile)
+            write_store_file(
+                summary_rows(monthRows),
+                os.path.join(summaryFolder, f"{monthKey}.parquet"),
+                groupByRoute=False,
+            )
+
+
+def format_new_files_batch(routeFiles, timeZone=TIME_ZONE):
+    """
+    Formats the combined files of many routes in a single pass, giving the
+    same files as calling format_new_files on each. All routes' rows are
+    concatenated with a route key, averaged into 15 minute periods with one
+    grouped mean, filled to each route's window, converted to compact rows
+    and strings together, and then split back into each route's file. This
+    avoids the fixed pandas cost of formatting many small files one by one.
+
+    Args:
+        routeFiles (list): (mergedFilePath, fromDateEpoch, toDateEpoch) for
+        each route
+        timeZone (string): IANA name of the local time zone
+
+    Returns:
+        compacts (list): Structured array of COMPACT_DTYPE for each route, in
+        the order of routeFiles
+    """
+    if not routeFiles:
+        return []
+    frames = []
+    for routeKey, (mergedFilePath, _, _) in enumerate(routeFiles):
+        df = pd.read_csv(mergedFilePath, usecols=["Timestamp"] + TRAVEL_TIMES)
+        df["Route"] = routeKey
+        frames.append(df)
+    df = pd.concat(frames, ignore_index=True)
+    df[TRAVEL_TIMES] = df[TRAVEL_TIMES].astype(np.float64).replace(0, np.nan)
+    df["Bin"] = df["Timestamp"].astype(np.int64) // (BIN_SECONDS * 1000)
+    df = df.groupby(["Route", "Bin"])[TRAVEL_TIMES].mean()
+    routeBins = [
+        np.arange(fromDateEpoch // BIN_SECONDS, toDateEpoch // BIN_SECONDS)
+        for _, fromDateEpoch, toDateEpoch in routeFiles
+    ]
+    lengths = [len(bins) for bins in routeBins]
+    bins = np.concatenate(routeBins)
+    routeKeys = np.repeat(np.arange(len(routeFiles)), lengths)
+    df = df.reindex(pd.MultiIndex.from_arrays([routeKeys, bins]))
+    travelTimes = {
+        column: pd.to_timedelta(df[column].values, unit="ms").seconds
+        for column in TRAVEL_TIMES
+    }
+    compact = compact_rows(bins, travelTimes)
+    masterRows = master_frame(compact, timeZone)
+    splits = np.cumsum(lengths)[:-1]
+    compacts = np.split(compact, splits)
+    starts = np.concatenate(([0], splits))
+    for (mergedFilePath, _, _), start, length in zip(
+        routeFiles, starts, lengths
+    ):
+        masterRows.iloc[start : start + length].to_csv(
+            mergedFilePath, index=False
+        )
+    return compacts
+
+
+def benchmark_formatting(routeCount=120, repeats=3):
+    """
+    Times formatting one day of downloaded data for routeCount routes with
+    format_new_files for each route against format_new_files_batch, and
+    checks both write identical files.
+
+    Args:
+        routeCount (int): Number of routes to generate
+        repeats (int): Number of times each way is run
+
+    Returns:
+        perRoute (float): Best time in seconds formatting route by route
+        batch (float): Best time in seconds formatting in one batch
+    """
+    tempFolder = tempfile.mkdtemp()
+    try:
+        fromDateEpoch = local_to_epoch(datetime(2020, 3, 2))
+        toDateEpoch = fromDateEpoch + 86400
+        randomState = np.random.RandomState(0)
+        rawFiles = []
+        for route in range(routeCount):
+            timestamps = np.sort(
+                randomState.randint(fromDateEpoch, toDateEpoch, 2000)
+            ) * 1000 + randomState.randint(0, 1000, 2000)
+            df = pd.DataFrame({"Timestamp": timestamps})
+            for column in TRAVEL_TIMES:
+                df[column] = randomState.randint(300000, 900000, len(df))
+                df.loc[randomState.rand(len(df)) < 0.05, column] = 0
+            rawFile = os.path.join(tempFolder, f"Route {route:03} raw.csv")
+            df.to_csv(rawFile, index=False)
+            rawFiles.append(rawFile)
+        timings = {"Route by route": [], "Batch": []}
+        for _ in range(repeats):
+            for name in timings:
+                routeFiles = []
+                for route, rawFile in enumerate(rawFiles):
+                    mergedFilePath = os.path.join(
+                        tempFolder, f"Route {route:03} {name}.csv"
+                    )
+                    shutil.copyfile(rawFile, mergedFilePath)
+                    routeFiles.append(
+                        (mergedFilePath, fromDateEpoch, toDateEpoch)
+                    )
+                began = time.perf_counter()
+                if name == "Batch":
+                    format_new_files_batch(routeFiles)
+                else:
+                    for routeFile in routeFiles:
+                        format_new_files(*routeFile)
+                timings[name].append(time.perf_counter() - began)
+        for route, rawFile in enumerate(rawFiles):
+            batchFile = os.path.join(tempFolder, f"Route {route:03} Batch.csv")
+            perRouteFile = os.path.join(
+                tempFolder, f"Route {route:03} Route by route.csv"
+            )
+            with open(batchFile, "rb") as f, open(perRouteFile, "rb") as g:
+                if f.read() != g.read():
+                    raise ValueError(f"Batch output differs for {rawFile}")
+    finally:
+        shutil.rmtree(tempFolder)
+    for name, times in timings.items():
+        print(f"{min(times):8.3f}s  {name}, {routeCount} routes x 1 day")
+    return min(timings["Route by route"]), min(timings["Batch"])
 
 
-def download_from_acyclica():
+def download_from_acyclica(batch=True):
     """
     Main function that runs through the process to download route data.
     - Creates a dictionary of Route IDs and Route Names.
     - Creates the base for url used by Acyclicas API to retrieve data.
-    - For each route in the dictionary of routes:
-        - Downloads data starting from the last date in the master file.
+    - For each route in the dictionary of routes, downloads data starting
+    from the last date in the master file while holding the route's lock.
+    A route that fails to download or stays locked is logged and skipped.
+    - Then for all downloaded routes together:
         - Formats data and merges into the master file while purging
         duplicates.
-        - Deletes data older than 2 years from the last date downloaded.
+        - Records coverage, gaps and outliers in the route's health report.
+        - Adds the new data to the query store.
+        - Archives data older than 2 years from the last date downloaded.
+
+    Args:
+        batch (bool): Format all routes together instead of one by one
     """
     acyclicaRoutes = route_dict()
     acyclicaBaseURL = base_url_creation()
+    timeZone = time_zone_setting()
+    routeUpdates = []
     for key, value in tqdm(acyclicaRoutes.items(), desc="Download All"):
         routeFolder, downloadFolder = folder_creation(value)
+        try:
+            with route_lock(routeFolder, value):
+                routeUpdate = download_route(
+                    acyclicaBaseURL,
+                    key,
+                    value,
+                    routeFolder,
+                    downloadFolder,
+                    timeZone,
+                )
+        except TimeoutError:
+            continue
+        if routeUpdate is not None:
+            routeUpdates.append(routeUpdate)
+    update_routes(routeUpdates, batch, timeZone)
+
+
+def download_route(
+    url, routeID, routeName, routeFolder, downloadFolder, timeZone=TIME_ZONE
+):
+    """
+    Downloads and merges everything missing from a route's master file.
+    A failed download is logged and its files removed so the other routes
+    can carry on; the route is tried again on the next run. Must be called
+    while holding the route's lock.
+
+    Args:
+        url (string): url used for Acyclica's API
+        routeID (string): The ID of the route being downloaded
+        routeName (string): Name of the route being downloaded
+        routeFolder (string): Folder containing all of a route's data
+        downloadFolder (string): Folder where all data is downloaded
+        timeZone (string): IANA name of the local time zone
+
+    Returns:
+        routeUpdate (dict): routeName, routeFolder, masterFile, masterSize,
+        mergedFilePath, fromDateEpoch, toDate and toDateEpoch of the
+        download, None if the route is already up to date or failed
+    """
+    check_old_files(downloadFolder)
+    masterFile = master_file_check(routeName, routeFolder)
+    recover_master(masterFile)
+    lastDate = get_last_date(masterFile)
+    fromDateEpoch, toDate, toDateEpoch = calc_time_interval(lastDate, timeZone)
+    if toDateEpoch <= fromDateEpoch:
+        return None
+    wDays, extraSec = epoch_differences(fromDateEpoch, toDateEpoch)
+    try:
+        loop_download(
+            url,
+            routeID,
+            routeName,
+            downloadFolder,
+            fromDateEpoch,
+            wDays,
+            extraSec,
+        )
+    except (ConnectionError, requests.RequestException) as error:
+        if not isinstance(error, ConnectionError):
+            logging.error(f"Error downloading route: {routeName}. {error}")
+        logging.warning(f"Skipped {routeName} until the next run")
         check_old_files(downloadFolder)
-        masterFile = master_file_check(value, routeFolder)
-        lastDate = get_last_date(masterFile)
-        fromDateEpoch, toDate, toDateEpoch = calc_time_interval(lastDate)
-        if toDateEpoch > fromDateEpoch:
-            wDays, extraSec = epoch_differences(fromDateEpoch, toDateEpoch)
-            loop_download(
-                acyclicaBaseURL,
-                key,
-                value,
-                downloadFolder,
-                fromDateEpoch,
-                wDays,
-                extraSec,
-            )
-            mergedFilePath = merge_downloaded_files(
-                routeFolder, downloadFolder, value
-            )
-            format_new_files(mergedFilePath, fromDateEpoch, toDateEpoch)
-            append_new_timeframes(mergedFilePath, masterFile)
-            delete_old_timeframes(toDate, masterFile)
+        return None
+    mergedFilePath = merge_downloaded_files(
+        routeFolder, downloadFolder, routeName
+    )
+    routeUpdate = {
+        "routeName": routeName,
+        "routeFolder": routeFolder,
+        "masterFile": masterFile,
+        "masterSize": os.path.getsize(masterFile),
+        "mergedFilePath": mergedFilePath,
+        "fromDateEpoch": fromDateEpoch,
+        "toDate": toDate,
+        "toDateEpoch": toDateEpoch,
+    }
+    return routeUpdate
+
+
+def update_routes(routeUpdates, batch=True, timeZone=TIME_ZONE):
+    """
+    Formats the downloads of every route, adds them to the query store in
+    one pass and then to each master file. Each route is locked again only
+    for this step. A route that is still locked, or whose master changed
+    since it was downloaded, is logged and left for the next run. The query
+    store is updated before the masters, so a crash in between only causes
+    the same rows to be stored again on the next run.
+
+    Args:
+        routeUpdates (list): Download details from download_route
+        batch (bool): Format all routes together instead of one by one
+        timeZone (string): IANA name of the local time zone
+    """
+    with ExitStack() as routeLocks:
+        lockedUpdates = []
+        for routeUpdate in routeUpdates:
+            try:
+                routeLocks.enter_context(
+                    route_lock(
+                        routeUpdate["routeFolder"], routeUpdate["routeName"]
+                    )
+                )
+            except TimeoutError:
+                continue
+            if (
+                os.path.getsize(routeUpdate["masterFile"])
+                != routeUpdate["masterSize"]
+            ):
+                logging.warning(
+                    f"Skipped {routeUpdate['routeName']}, master file changed "
+                    f"since it was downloaded"
+                )
+                continue
+            lockedUpdates.append(routeUpdate)
+        routeFiles = [
+            (u["mergedFilePath"], u["fromDateEpoch"], u["toDateEpoch"])
+            for u in lockedUpdates
+        ]
+        if batch:
+            newRows = format_new_files_batch(routeFiles, timeZone)
         else:
-            continue
+            newRows = [
+                format_new_files(*routeFile, timeZone)
+                for routeFile in routeFiles
+            ]
+        lastBins = np.array([c["Bin"][-1] for c in newRows if len(c)])
+        lastMonth = 0
+        if len(lastBins):
+            lastDateKey = calendar_lookup(lastBins, timeZone)["DateKey"].max()
+            lastMonth = int(lastDateKey) // 100
+        baselines = route_baselines(
+            [u["routeName"] for u in lockedUpdates], lastMonth
+        )
+        for routeUpdate, compact in zip(lockedUpdates, newRows):
+            check_route_health(
+                routeUpdate["routeName"],
+                routeUpdate["routeFolder"],
+                compact,
+                baselines[routeUpdate["routeName"]],
+                timeZone,
+            )
+        store_query_rows(
+            [
+                query_rows(routeUpdate["routeName"], compact, timeZone)
+                for routeUpdate, compact in zip(lockedUpdates, newRows)
+            ]
+        )
+        for routeUpdate in lockedUpdates:
+            finish_route(routeUpdate)
+
+
+def finish_route(routeUpdate):
+    """
+    Appends a route's formatted download to its master file and archives
+    time frames older than 2 years. Must be called while holding the route's
+    lock, after the new rows are in the query store.
+
+    Args:
+        routeUpdate (dict): Download details from download_route
+    """
+    append_new_timeframes(
+        routeUpdate["mergedFilePath"], routeUpdate["masterFile"]
+    )
+    delete_old_timeframes(
+        routeUpdate["toDate"],
+        routeUpdate["masterFile"],
+        routeUpdate["routeFolder"],
+    )
 
 
 if __name__ == "__main__":
-    download_from_acyclica()
+    if "--benchmark" in sys.argv:
+        benchmark_formatting()
+    elif "--route-by-route" in sys.argv:
+        download_from_acyclica(batch=False)
+    else:
+        download_from_acyclica()
@@ -23,8 +23,7 @@ import os.path
 import sys
 import time
 import urllib
-from datetime import datetime
-from dateutil import tz
+from datetime import datetime, timedelta
 from urllib import request
 from urllib.request import urlretrieve
 import pandas as pd
@@ -32,6 +31,9 @@ import numpy as np
 from tqdm import tqdm
 
 
+TIME_ZONE = "US/Central"
+
+
 def username_input(API_Key=None, User_Name=None):
     """
     Requests username, looks in a csv file for the username, and returns the
@@ -104,20 +106,47 @@ def user_date_input():
     return start_date, end_date, start_date_request, end_date_request
 
 
-def start_end_times():
+def time_zone_setting():
+    """
+    Reads the local time zone from the first line of TimeZone.csv, falling
+    back to TIME_ZONE when the file is not present.
+    """
+    try:
+        TimeZone = open("TimeZone.csv", "r").readline().strip()
+    except FileNotFoundError:
+        TimeZone = ""
+    return TimeZone or TIME_ZONE
+
+
+def local_to_epoch(LocalDate, TimeZone=TIME_ZONE):
+    """
+    Converts a local date and time in TimeZone to epoch seconds. A time
+    repeated when clocks fall back is taken as the later, standard time one
+    and a time skipped when clocks spring forward is moved to the end of
+    the gap.
+    """
+    LocalStamp = pd.Timestamp(LocalDate).tz_localize(
+        TimeZone, ambiguous=False, nonexistent="shift_forward"
+    )
+    return int(LocalStamp.timestamp())
+
+
+def start_end_times(TimeZone=TIME_ZONE):
     """
     Converts user inputed dates to epoch times for use in url download
-    requests.
+    requests. Every day boundary is a local midnight in TimeZone,
+    independent of the time zone of the computer running the download, so
+    days where clocks change are 23 or 25 hours long.
     """
     StartDate, EndDate, StartDate_Str, EndDate_Str = user_date_input()
     Delta = EndDate - StartDate
     TotalDays = Delta.days + 1
-    Epoch = datetime.utcfromtimestamp(0)
-    StartDate = StartDate.astimezone(tz.tzutc()).replace(tzinfo=None)
-    StartDateInEpoch = StartDate - Epoch
-    StartEpochSeconds = int((StartDateInEpoch).total_seconds())
+    DayEpochs = [
+        local_to_epoch(StartDate + timedelta(days=Day), TimeZone)
+        for Day in range(TotalDays + 1)
+    ]
     print(f"Requesting {TotalDays} total days of data.")
-    return StartEpochSeconds, TotalDays, StartDate_Str, EndDate_Str
+    return DayEpochs, TotalDays, StartDate_Str, EndDate_Str
 
 
 def timedelta_h_m_s(delta):
@@ -164,15 +193,15 @@ def folder_creation(RouteName):
     return FolderPath, SubFolder
 
 
-def download_files(SubFolder, StartTime, URL_Base, Days, key, value):
+def download_files(SubFolder, DayEpochs, URL_Base, key, value):
     """
     Downloads a day of data from Acyclica at a time by piecing together the
-    url with start and end times each 24 hour period between the user request
+    url with start and end times of each local day between the user request
     start and end dates.
     """
-    for i in range(Days):
-        Start = str(StartTime + 86400 * i)
-        End = str(StartTime + 86400 * (i + 1))
+    for StartEpoch, EndEpoch in zip(DayEpochs[:-1], DayEpochs[1:]):
+        Start = str(StartEpoch)
+        End = str(EndEpoch)
         Acyclica_URL = f"{URL_Base}/{key}/{Start}/{End}/"
         FileName = f"{SubFolder}/{value} {Start}.csv"
         urllib.request.urlretrieve(Acyclica_URL, FileName)
@@ -200,7 +229,7 @@ def delete_downloaded_files(SubFolder):
             os.remove(f"{SubFolder}/{filename}")
 
 
-def format_new_files(CombinedFileToBeFormatted):
+def format_new_files(CombinedFileToBeFormatted, TimeZone=TIME_ZONE):
     """
     Formats the combined file for use in Excel
     -Removes lines containing 0s (missing data) as to not influence averages
@@ -213,7 +242,7 @@ def format_new_files(CombinedFileToBeFormatted):
     df = df.replace(0, np.nan)
     df = df.resample("15min", base=0, on="Timestamp").mean()
     df = df.reset_index()
-    df["Timestamp"] = df["Timestamp"].dt.tz_localize("utc").dt.tz_convert("US/Central")
+    df["Timestamp"] = df["Timestamp"].dt.tz_localize("utc").dt.tz_convert(TimeZone)
     df["Timestamp"] = pd.to_datetime(df["Timestamp"], unit="ms").apply(
         "{:%B %A %w %Y-%m-%d %H:%M:%S}".format
     )
@@ -281,16 +310,16 @@ def finished(Days, AcyclicaRoutes):
 def main():
     """Main Function that runs the entire program"""
     URL_Base = base_url_creation()
-    StartEpoch, Days, StartDateStr, EndDateStr = start_end_times()
+    TimeZone = time_zone_setting()
+    DayEpochs, Days, StartDateStr, EndDateStr = start_end_times(TimeZone)
     AcyclicaRoutes = route_dict()
     for key, value in tqdm(AcyclicaRoutes.items()):
-        StartTime = StartEpoch
         FolderPath, SubFolder = folder_creation(value)
-        download_files(SubFolder, StartTime, URL_Base, Days, key, value)
+        download_files(SubFolder, DayEpochs, URL_Base, key, value)
         CombinedFileToBeFormatted = merge_downloaded_files(
             FolderPath, SubFolder, value, StartDateStr, EndDateStr
         )
-        format_new_files(CombinedFileToBeFormatted)
+        format_new_files(CombinedFileToBeFormatted, TimeZone)
     finished(Days, AcyclicaRoutes)
 
 
@@ -0,0 +1,439 @@
+#!python
+"""
+Query API to compare travel times across routes, date ranges, days of the
+week and times of day without loading master files into Excel. Queries are
+answered from the query store kept by DailyTravelTimeDownload: one parquet
+file per local month holding every route's 15 minute travel times in
+seconds, one row group per route. Months outside the requested dates are
+never opened, only the requested columns are read, and the route statistics
+of each row group are used as an index so other routes' row groups are
+skipped. The date, day of week and time of day filters are applied to the
+rows read.
+
+Example:
+    query(
+        ["NB Main Avenue", "SB Main Avenue"],
+        "2020-01-01",
+        "2020-06-30",
+        dow=[2, 3, 4, 5, 6],
+        timeRange=("07:00", "09:00"),
+        agg="mean",
+        by=["Slot"],
+    )
+
+Running this file rebuilds the query store from every route's archive and
+master file. Running it with --benchmark times queries against two years of
+generated data for 120 routes, and with --memory compares the memory used
+by the master files as strings and in compact form.
+"""
+
+
+import bisect
+import calendar
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from tqdm import tqdm
+from DailyTravelTimeDownload import (
+    BIN_SECONDS,
+    QUERY_FOLDER,
+    TRAVEL_TIMES,
+    compact_from_master,
+    compact_rows,
+    load_timeframes,
+    master_frame,
+    query_rows,
+    read_master_compact,
+    route_dict,
+    store_query_rows,
+    summary_rows,
+    time_zone_setting,
+    write_store_file,
+)
+
+
+def date_key(date):
+    """
+    Converts a "yyyy-mm-dd" date to the yyyymmdd integer used in the store.
+
+    Args:
+        date (string): Date in yyyy-mm-dd format
+
+    Returns:
+        dateKey (int): Date in yyyymmdd format
+    """
+    return int(date[:10].replace("-", ""))
+
+
+def slot_key(timeOfDay):
+    """
+    Converts a "hh:mm" time to its 15 minute period of the day.
+
+    Args:
+        timeOfDay (string): Time in hh:mm format
+
+    Returns:
+        slot (int): 15 minute period of the day, 0 to 96
+    """
+    hours, minutes = timeOfDay.split(":")[:2]
+    return int(hours) * 4 + int(minutes) // 15
+
+
+def read_store_file(storeFile, routes, columns):
+    """
+    Reads the requested routes from a query store file. The route statistics
+    of each row group in the file's metadata are used as an index, so row
+    groups holding only other routes are never read. Rows of other routes
+    sharing a row group are dropped after reading.
+
+    Args:
+        storeFile (string): Location of the parquet file
+        routes (list): Sorted route names to read
+        columns (list): Columns to read
+
+    Returns:
+        df (dataframe): Rows of the requested routes
+    """
+    parquetFile = pq.ParquetFile(storeFile)
+    metadata = parquetFile.metadata
+    routeColumn = metadata.schema.names.index("Route")
+    rowGroups = []
+    for i in range(metadata.num_row_groups):
+        statistics = metadata.row_group(i).column(routeColumn).statistics
+        first = bisect.bisect_left(routes, statistics.min)
+        if first < len(routes) and routes[first] <= statistics.max:
+            rowGroups.append(i)
+    df = parquetFile.read_row_groups(
+        rowGroups, columns=columns, use_pandas_metadata=False
+    ).to_pandas()
+    return df[df["Route"].isin(routes)]
+
+
+def whole_month(monthKey, startKey, endKey):
+    """
+    Checks whether every day of a month is inside a requested date range.
+
+    Args:
+        monthKey (int): Month in yyyymm format
+        startKey (int): First date in yyyymmdd format
+        endKey (int): Last date in yyyymmdd format
+
+    Returns:
+        bool: True when the whole month is requested
+    """
+    lastDay = calendar.monthrange(monthKey // 100, monthKey % 100)[1]
+    return startKey <= monthKey * 100 + 1 and monthKey * 100 + lastDay <= endKey
+
+
+def query(
+    routes,
+    start,
+    end,
+    dow=None,
+    timeRange=None,
+    agg="mean",
+    by=None,
+    columns=None,
+    queryFolder=QUERY_FOLDER,
+):
+    """
+    Reads and aggregates travel times for one or more routes. A "mean",
+    "sum" or "count" grouped by nothing, DoW or Slot is answered from the
+    monthly pre-aggregated summaries for every month that is wholly inside
+    the requested dates, and from the 15 minute rows for the rest.
+
+    Args:
+        routes (list): Route names to compare, or a single route name
+        start (string): First local date to include, yyyy-mm-dd
+        end (string): Last local date to include, yyyy-mm-dd
+        dow (list): Days of the week to include, 1 = Sunday to 7 = Saturday.
+        All days when None.
+        timeRange (tuple): Local ("hh:mm", "hh:mm") times of day to include,
+        start inclusive and end exclusive. All day when None.
+        agg (string): Aggregation such as "mean", "median", "min", "max" or
+        "count". None returns the matching 15 minute rows.
+        by (list): Store columns to group by along with Route, e.g. ["Slot"]
+        for time of day, ["Date"], or ["DoW"]. One value per route when None.
+        columns (list): Travel times to return. All when None.
+        queryFolder (string): Location of the query store
+
+    Returns:
+        df (dataframe): Travel times in seconds, indexed by Route and the by
+        columns when aggregated. Use .to_numpy() for a NumPy array.
+    """
+    if isinstance(routes, str):
+        routes = [routes]
+    if isinstance(dow, int):
+        dow = [dow]
+    routes = sorted(set(routes))
+    columns = list(columns or TRAVEL_TIMES)
+    by = list(by or [])
+    startKey, endKey = date_key(start), date_key(end)
+    summarized = agg in ("mean", "sum", "count") and set(by) <= {"DoW", "Slot"}
+    rawColumns = ["Route", "Bin", "Date", "DoW", "Slot"] + columns
+    summaryColumns = ["Route", "DoW", "Slot"]
+    for column in columns:
+        summaryColumns += [f"{column} Sum", f"{column} Count"]
+    rawFrames, summaryFrames = [], []
+    for monthFile in sorted(glob.glob(os.path.join(queryFolder, "*.parquet"))):
+        monthKey = int(os.path.basename(monthFile)[:6])
+        if not startKey // 100 <= monthKey <= endKey // 100:
+            continue
+        summaryFile = os.path.join(
+            queryFolder, "Summary", f"{monthKey}.parquet"
+        )
+        if (
+            summarized
+            and whole_month(monthKey, startKey, endKey)
+            and os.path.isfile(summaryFile)
+        ):
+            summaryFrames.append(
+                read_store_file(summaryFile, routes, summaryColumns)
+            )
+        else:
+            rawFrames.append(read_store_file(monthFile, routes, rawColumns))
+    raw = pd.DataFrame(columns=rawColumns)
+    if rawFrames:
+        raw = pd.concat(rawFrames, ignore_index=True)
+        inRange = (raw["Date"] >= startKey) & (raw["Date"] <= endKey)
+        raw = raw[inRange]
+    if agg is None:
+        return filter_rows(raw, dow, timeRange).reset_index(drop=True)
+    if not summarized:
+        raw = filter_rows(raw, dow, timeRange)
+        if raw.empty:
+            return pd.DataFrame(columns=columns)
+        return raw.groupby(["Route"] + by, sort=True)[columns].agg(agg)
+    summaries = [summary_rows(raw, columns)] if len(raw) else []
+    summaries += summaryFrames
+    if not summaries:
+        return pd.DataFrame(columns=columns)
+    summary = pd.concat(summaries, ignore_index=True, sort=False)
+    summary = filter_rows(summary, dow, timeRange)
+    totals = summary.groupby(["Route"] + by, sort=True).sum()
+    result = pd.DataFrame(index=totals.index)
+    for column in columns:
+        sums, counts = totals[f"{column} Sum"], totals[f"{column} Count"]
+        if agg == "mean":
+            result[column] = sums / counts.where(counts > 0)
+        elif agg == "sum":
+            result[column] = sums
+        else:
+            result[column] = counts
+    return result
+
+
+def filter_rows(df, dow, timeRange):
+    """
+    Keeps the rows of a query store dataframe matching the day of week and
+    time of day filters.
+
+    Args:
+        df (dataframe): Rows with DoW and Slot columns
+        dow (list): Days of the week to include, None for all
+        timeRange (tuple): Local ("hh:mm", "hh:mm") times of day, None for all
+
+    Returns:
+        df (dataframe): Matching rows
+    """
+    if dow is not None:
+        df = df[df["DoW"].isin(dow)]
+    if timeRange is not None:
+        slots = df["Slot"]
+        df = df[
+            (slots >= slot_key(timeRange[0])) & (slots < slot_key(timeRange[1]))
+        ]
+    return df
+
+
+def build_query_store(
+    routes=None, timeZone=None, queryFolder=QUERY_FOLDER, flushRoutes=20
+):
+    """
+    Rebuilds the query store from each route's archive and master file.
+    Needed once for data downloaded before the store existed; afterwards the
+    daily download keeps it up to date. Rows are stored flushRoutes routes
+    at a time, so each month file is rewritten once per batch of routes
+    rather than once per route.
+
+    Args:
+        routes (list): Route names to load. All routes in the route file
+        when None.
+        timeZone (string): IANA name of the local time zone
+        queryFolder (string): Location of the query store
+        flushRoutes (int): Number of routes loaded before storing their rows
+    """
+    routes = routes or list(route_dict().values())
+    timeZone = timeZone or time_zone_setting()
+    frames = []
+    for i, routeName in enumerate(tqdm(routes, desc="Build Query Store")):
+        df = load_timeframes(
+            routeName, "0000-00-00 00:00:00", "9999-99-99 99:99:99"
+        )
+        if not df.empty:
+            compact = compact_from_master(df, timeZone)
+            frames.append(query_rows(routeName, compact, timeZone))
+        if (i + 1) % flushRoutes == 0 or i + 1 == len(routes):
+            store_query_rows(frames, queryFolder)
+            frames = []
+
+
+def benchmark_query(routeCount=120, days=730, repeats=5):
+    """
+    Times typical comparison queries against generated travel times for
+    routeCount routes over the given number of days, stored the same way as
+    the real query store in a temporary folder.
+
+    Args:
+        routeCount (int): Number of routes to generate
+        days (int): Number of days per route to generate
+        repeats (int): Number of times each query is run
+
+    Returns:
+        results (dict): Best time in seconds for each query
+    """
+    queryFolder = tempfile.mkdtemp()
+    os.makedirs(os.path.join(queryFolder, "Summary"))
+    try:
+        dates = pd.date_range("2019-01-01", periods=days, freq="D")
+        slots = np.tile(np.arange(96, dtype=np.int8), days)
+        dateKeys = np.repeat(
+            dates.strftime("%Y%m%d").astype(int).values.astype(np.int32), 96
+        )
+        dows = np.repeat(((dates.dayofweek + 1) % 7 + 1).values, 96)
+        randomState = np.random.RandomState(0)
+        for monthKey in np.unique(dateKeys // 100):
+            inMonth = dateKeys // 100 == monthKey
+            frames = []
+            for route in range(routeCount):
+                frame = pd.DataFrame(
+                    {
+                        "Route": f"Route {route:03}",
+                        "Bin": np.flatnonzero(inMonth).astype(np.int32),
+                        "Date": dateKeys[inMonth],
+                        "DoW": dows[inMonth].astype(np.int8),
+                        "Slot": slots[inMonth],
+                    }
+                )
+                for column in TRAVEL_TIMES:
+                    frame[column] = randomState.normal(
+                        600, 60, inMonth.sum()
+                    ).astype(np.float32)
+                frames.append(frame)
+            monthRows = pd.concat(frames, ignore_index=True)
+            write_store_file(
+                monthRows, os.path.join(queryFolder, f"{monthKey}.parquet")
+            )
+            write_store_file(
+                summary_rows(monthRows),
+                os.path.join(queryFolder, "Summary", f"{monthKey}.parquet"),
+                groupByRoute=False,
+            )
+        allRoutes = [f"Route {route:03}" for route in range(routeCount)]
+        firstDate = dates[0].strftime("%Y-%m-%d")
+        lastDate = dates[-1].strftime("%Y-%m-%d")
+        queries = {
+            "2 routes, 2 years, weekday AM peak by time of day": dict(
+                routes=allRoutes[:2],
+                start=firstDate,
+                end=lastDate,
+                dow=[2, 3, 4, 5, 6],
+                timeRange=("07:00", "09:00"),
+                by=["Slot"],
+                columns=["Strengths"],
+            ),
+            "All routes, 2 years, mean by day of week": dict(
+                routes=allRoutes,
+                start=firstDate,
+                end=lastDate,
+                by=["DoW"],
+                columns=["Strengths"],
+            ),
+            "All routes, 6 weeks, weekday PM peak by time of day": dict(
+                routes=allRoutes,
+                start="2020-02-15",
+                end="2020-03-31",
+                dow=[2, 3, 4, 5, 6],
+                timeRange=("16:00", "18:00"),
+                by=["Slot"],
+            ),
+            "All routes, 1 month, all travel times by date": dict(
+                routes=allRoutes,
+                start="2020-03-01",
+                end="2020-03-31",
+                by=["Date"],
+            ),
+        }
+        results = {}
+        for name, kwargs in queries.items():
+            timings = []
+            for _ in range(repeats):
+                began = time.perf_counter()
+                query(queryFolder=queryFolder, **kwargs)
+                timings.append(time.perf_counter() - began)
+            results[name] = min(timings)
+            print(f"{min(timings):8.3f}s  {name}")
+    finally:
+        shutil.rmtree(queryFolder)
+    return results
+
+
+def benchmark_memory(masterFiles=None, days=730):
+    """
+    Compares the memory used by master files loaded as the usual string
+    dataframe against the same rows in compact form. Measures every master
+    file given, or a generated two year master when there are none.
+
+    Args:
+        masterFiles (list): Locations of master files to measure
+        days (int): Number of days for the generated master
+
+    Returns:
+        frameBytes (int): Total bytes used by the string dataframes
+        compactBytes (int): Total bytes used by the compact arrays
+    """
+    tempFolder = tempfile.mkdtemp()
+    try:
+        if not masterFiles:
+            firstBin = int(pd.Timestamp("2019-01-01").timestamp()) // BIN_SECONDS
+            bins = np.arange(firstBin, firstBin + days * 96)
+            randomState = np.random.RandomState(0)
+            travelTimes = {
+                column: randomState.normal(600, 60, len(bins))
+                for column in TRAVEL_TIMES
+            }
+            masterFile = os.path.join(tempFolder, "Generated - Master.csv")
+            master_frame(compact_rows(bins, travelTimes)).to_csv(
+                masterFile, index=False
+            )
+            masterFiles = [masterFile]
+        frameBytes = compactBytes = rows = 0
+        for masterFile in masterFiles:
+            frameBytes += pd.read_csv(masterFile).memory_usage(deep=True).sum()
+            compact = read_master_compact(masterFile, time_zone_setting())
+            compactBytes += compact.nbytes
+            rows += len(compact)
+    finally:
+        shutil.rmtree(tempFolder)
+    print(
+        f"{len(masterFiles)} master files, {rows} rows: "
+        f"{frameBytes / 2 ** 20:.1f} MiB as strings, "
+        f"{compactBytes / 2 ** 20:.1f} MiB compact, "
+        f"{frameBytes / compactBytes:.0f}x smaller"
+    )
+    return frameBytes, compactBytes
+
+
+if __name__ == "__main__":
+    if "--benchmark" in sys.argv:
+        benchmark_query()
+    elif "--memory" in sys.argv:
+        benchmark_memory(glob.glob("AcyclicaData\\*\\* - Master.csv"))
+    else:
+        build_query_store()
@@ -0,0 +1,116 @@
+"""
+Checks moving expired months from the master file into the archive and
+reading them back with load_timeframes.
+"""
+
+import glob
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import DailyTravelTimeDownload as daily
+
+
+TIME_ZONE = "US/Central"
+ROUTE = "NB Main Avenue"
+EVERYTHING = ("0000-00-00 00:00:00", "9999-99-99 99:99:99")
+
+
+@pytest.fixture
+def route(tmp_path, monkeypatch):
+    """A route with a master from October 2018 to December 2020."""
+    monkeypatch.chdir(tmp_path)
+    routeFolder, _ = daily.folder_creation(ROUTE)
+    masterFile = f"{routeFolder}\\{ROUTE} - Master.csv"
+    firstBin = daily.local_to_epoch(datetime(2018, 10, 1), TIME_ZONE) // 900
+    lastBin = daily.local_to_epoch(datetime(2021, 1, 1), TIME_ZONE) // 900
+    bins = np.arange(firstBin, lastBin)
+    randomState = np.random.RandomState(0)
+    travelTimes = {
+        column: randomState.randint(60, 1800, len(bins)).astype(float)
+        for column in daily.TRAVEL_TIMES
+    }
+    compact = daily.compact_rows(bins, travelTimes)
+    daily.master_frame(compact, TIME_ZONE).to_csv(masterFile, index=False)
+    return routeFolder, masterFile, pd.read_csv(masterFile)
+
+
+def archive_files(routeFolder):
+    pattern = os.path.join(routeFolder, "Archive", "*", "*", "*.parquet")
+    return sorted(glob.glob(pattern))
+
+
+def test_whole_months_are_archived_once(route):
+    routeFolder, masterFile, original = route
+    daily.delete_old_timeframes(datetime(2020, 12, 15), masterFile, routeFolder)
+    assert [os.path.basename(f) for f in archive_files(routeFolder)] == [
+        "2018-10.parquet",
+        "2018-11.parquet",
+    ]
+    master = pd.read_csv(masterFile)
+    assert master["DateTime"].iloc[0] == "2018-12-01 00:00:00"
+    assert len(master) + sum(
+        len(pd.read_parquet(f)) for f in archive_files(routeFolder)
+    ) == len(original)
+
+    before = {f: os.stat(f).st_mtime_ns for f in archive_files(routeFolder)}
+    masterBytes = open(masterFile, "rb").read()
+    daily.delete_old_timeframes(datetime(2020, 12, 31), masterFile, routeFolder)
+    assert open(masterFile, "rb").read() == masterBytes
+    assert {f: os.stat(f).st_mtime_ns for f in archive_files(routeFolder)} == (
+        before
+    )
+
+    daily.delete_old_timeframes(datetime(2021, 1, 1), masterFile, routeFolder)
+    assert len(archive_files(routeFolder)) == 3
+    assert pd.read_csv(masterFile)["DateTime"].iloc[0] == "2019-01-01 00:00:00"
+
+
+def test_load_timeframes_returns_every_row_once(route):
+    routeFolder, masterFile, original = route
+    daily.delete_old_timeframes(datetime(2021, 1, 1), masterFile, routeFolder)
+    loaded = daily.load_timeframes(ROUTE, *EVERYTHING)
+    assert loaded.astype(str).values.tolist() == (
+        original.astype(str).values.tolist()
+    )
+
+    span = daily.load_timeframes(
+        ROUTE, "2018-12-31 23:30:00", "2019-01-01 00:30:00"
+    )
+    assert span["DateTime"].tolist() == [
+        "2018-12-31 23:30:00",
+        "2018-12-31 23:45:00",
+        "2019-01-01 00:00:00",
+        "2019-01-01 00:15:00",
+        "2019-01-01 00:30:00",
+    ]
+
+
+def test_range_before_master_skips_the_master(route, monkeypatch):
+    routeFolder, masterFile, original = route
+    daily.delete_old_timeframes(datetime(2020, 12, 15), masterFile, routeFolder)
+
+    def fail(masterFile):
+        raise AssertionError("master read for a range before its first row")
+
+    monkeypatch.setattr(daily, "read_master_snapshot", fail)
+    loaded = daily.load_timeframes(
+        ROUTE, "2018-11-03 00:00:00", "2018-11-04 23:45:00"
+    )
+    expected = original[original["DateTime"].str[:10].isin(["2018-11-03"])]
+    assert loaded["DateTime"].iloc[0] == "2018-11-03 00:00:00"
+    assert loaded["DateTime"].iloc[-1] == "2018-11-04 23:45:00"
+    # 2018-11-04 is the fall back day with 100 periods
+    assert len(loaded) == len(expected) + 100
+
+
+def test_partial_last_line_is_ignored(route):
+    routeFolder, masterFile, original = route
+    with open(masterFile, "ab") as master:
+        master.write(b"2021-01-01 00:00:00,January,Fri")
+    loaded = daily.load_timeframes(ROUTE, *EVERYTHING)
+    assert len(loaded) == len(original)
+    assert loaded["DateTime"].iloc[-1] == "2020-12-31 23:45:00"
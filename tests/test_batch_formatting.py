@@ -0,0 +1,90 @@
+"""
+Checks format_new_files_batch writes the same files and returns the same
+compact rows as format_new_files called on each route.
+"""
+
+import shutil
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import DailyTravelTimeDownload as daily
+
+
+TIME_ZONE = "US/Central"
+HEADER = "Timestamp," + ",".join(daily.TRAVEL_TIMES) + "\n"
+
+WINDOWS = {
+    "Full day": (datetime(2020, 3, 2), datetime(2020, 3, 3)),
+    "Partial day": (datetime(2020, 6, 1, 6, 45), datetime(2020, 6, 1, 18)),
+    "Empty download": (datetime(2020, 6, 1), datetime(2020, 6, 2)),
+    "Spring forward": (datetime(2020, 3, 7, 12), datetime(2020, 3, 9)),
+    "Fall back": (datetime(2020, 10, 31), datetime(2020, 11, 2)),
+}
+
+
+def write_download(mergedFilePath, fromDateEpoch, toDateEpoch, randomState):
+    """Writes a merged download with readings every few minutes."""
+    timestamps = np.sort(
+        randomState.randint(fromDateEpoch, toDateEpoch, 400)
+    ) * 1000 + randomState.randint(0, 1000, 400)
+    df = pd.DataFrame({"Timestamp": timestamps})
+    for column in daily.TRAVEL_TIMES:
+        df[column] = randomState.randint(60000, 1800000, len(df))
+        df.loc[randomState.rand(len(df)) < 0.1, column] = 0
+    df.to_csv(mergedFilePath, index=False)
+
+
+def test_batch_matches_route_by_route(tmp_path):
+    randomState = np.random.RandomState(0)
+    routeFiles = []
+    for name, (fromDate, toDate) in WINDOWS.items():
+        fromDateEpoch = daily.local_to_epoch(fromDate, TIME_ZONE)
+        toDateEpoch = daily.local_to_epoch(toDate, TIME_ZONE)
+        mergedFilePath = str(tmp_path / f"{name} Batch.csv")
+        if name == "Empty download":
+            with open(mergedFilePath, "w") as f:
+                f.write(HEADER)
+        else:
+            write_download(
+                mergedFilePath, fromDateEpoch, toDateEpoch, randomState
+            )
+        shutil.copyfile(mergedFilePath, str(tmp_path / f"{name} Route.csv"))
+        routeFiles.append((mergedFilePath, fromDateEpoch, toDateEpoch))
+
+    batch = daily.format_new_files_batch(routeFiles, TIME_ZONE)
+    assert len(batch) == len(WINDOWS)
+    for name, (mergedFilePath, fromDateEpoch, toDateEpoch), compact in zip(
+        WINDOWS, routeFiles, batch
+    ):
+        routePath = mergedFilePath.replace(" Batch.csv", " Route.csv")
+        expected = daily.format_new_files(
+            routePath, fromDateEpoch, toDateEpoch, TIME_ZONE
+        )
+        assert compact.dtype == expected.dtype
+        assert np.array_equal(compact, expected), name
+        with open(mergedFilePath, "rb") as f, open(routePath, "rb") as g:
+            assert f.read() == g.read(), name
+
+
+def test_transition_windows_have_every_period(tmp_path):
+    springFrom = daily.local_to_epoch(datetime(2020, 3, 8), TIME_ZONE)
+    springTo = daily.local_to_epoch(datetime(2020, 3, 9), TIME_ZONE)
+    fallFrom = daily.local_to_epoch(datetime(2020, 11, 1), TIME_ZONE)
+    fallTo = daily.local_to_epoch(datetime(2020, 11, 2), TIME_ZONE)
+    routeFiles = []
+    for name, fromDateEpoch, toDateEpoch in [
+        ("Spring", springFrom, springTo),
+        ("Fall", fallFrom, fallTo),
+    ]:
+        mergedFilePath = str(tmp_path / f"{name}.csv")
+        with open(mergedFilePath, "w") as f:
+            f.write(HEADER)
+        routeFiles.append((mergedFilePath, fromDateEpoch, toDateEpoch))
+    spring, fall = daily.format_new_files_batch(routeFiles, TIME_ZONE)
+    assert len(spring) == 92
+    assert len(fall) == 100
+    times = pd.read_csv(routeFiles[1][0])["Time"]
+    assert (times == "01:00:00").sum() == 2
+    assert (spring["Strengths"] == daily.MISSING_SECONDS).all()
@@ -0,0 +1,117 @@
+"""
+Checks the master file's crash safety: rolling back an interrupted append
+from its journal, removing unfinished temp files, verified appends and the
+route lock.
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import DailyTravelTimeDownload as daily
+
+
+HEADER = b"DateTime,Month,Day,DoW,Date,Time,Strengths\n"
+ROWS = (
+    b"2020-05-01 00:00:00,May,Friday,6,2020-05-01,00:00:00,00:10:00\n"
+    b"2020-05-01 00:15:00,May,Friday,6,2020-05-01,00:15:00,00:10:00\n"
+)
+
+
+@pytest.fixture
+def masterFile(tmp_path):
+    masterFile = str(tmp_path / "NB Main Avenue - Master.csv")
+    with open(masterFile, "wb") as f:
+        f.write(HEADER + ROWS)
+    return masterFile
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_interrupted_append_is_rolled_back(masterFile):
+    originalSize = os.path.getsize(masterFile)
+    with open(f"{masterFile}.journal", "w") as journal:
+        journal.write(str(originalSize))
+    with open(masterFile, "ab") as master:
+        master.write(b"2020-05-01 00:30:00,May,Fri")
+    daily.recover_master(masterFile)
+    assert read(masterFile) == HEADER + ROWS
+    assert not os.path.exists(f"{masterFile}.journal")
+
+
+def test_journal_without_append_leaves_master(masterFile):
+    with open(f"{masterFile}.journal", "w") as journal:
+        journal.write(str(os.path.getsize(masterFile)))
+    daily.recover_master(masterFile)
+    assert read(masterFile) == HEADER + ROWS
+    assert not os.path.exists(f"{masterFile}.journal")
+
+
+def test_unfinished_temp_files_are_removed(masterFile):
+    for tempFile in (f"{masterFile}.tmp", f"{masterFile}.journal.tmp"):
+        with open(tempFile, "wb") as f:
+            f.write(HEADER)
+    daily.recover_master(masterFile)
+    assert read(masterFile) == HEADER + ROWS
+    assert not os.path.exists(f"{masterFile}.tmp")
+    assert not os.path.exists(f"{masterFile}.journal.tmp")
+
+
+def test_append_adds_only_new_rows(masterFile, tmp_path):
+    newRows = b"2020-05-01 00:30:00,May,Friday,6,2020-05-01,00:30:00,\n"
+    mergedFilePath = str(tmp_path / "NB Main Avenue temp.csv")
+    with open(mergedFilePath, "wb") as f:
+        f.write(HEADER + newRows)
+    daily.append_new_timeframes(mergedFilePath, masterFile)
+    assert read(masterFile) == HEADER + ROWS + newRows
+    assert not os.path.exists(f"{masterFile}.journal")
+    assert not os.path.exists(mergedFilePath)
+
+
+def test_held_route_lock_times_out(tmp_path, monkeypatch):
+    monkeypatch.setattr(daily, "LOCK_WAIT_SECONDS", 0)
+    routeFolder = str(tmp_path)
+    with daily.route_lock(routeFolder, "NB Main Avenue"):
+        with pytest.raises(TimeoutError):
+            with daily.route_lock(routeFolder, "NB Main Avenue"):
+                pass
+    with daily.route_lock(routeFolder, "NB Main Avenue"):
+        pass
+    assert os.path.isfile(os.path.join(routeFolder, "NB Main Avenue.lock"))
+
+
+def test_route_lock_released_when_holder_dies(tmp_path, monkeypatch):
+    monkeypatch.setattr(daily, "LOCK_WAIT_SECONDS", 0)
+    routeFolder = str(tmp_path)
+    holder = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import time, DailyTravelTimeDownload as daily\n"
+            f"with daily.route_lock({routeFolder!r}, 'NB Main Avenue'):\n"
+            "    print('held', flush=True)\n"
+            "    time.sleep(60)\n",
+        ],
+        cwd=str(tmp_path),
+        env=dict(
+            os.environ,
+            PYTHONPATH=os.path.dirname(os.path.abspath(daily.__file__)),
+        ),
+        stdout=subprocess.PIPE,
+    )
+    try:
+        assert holder.stdout.readline().strip() == b"held"
+        with pytest.raises(TimeoutError):
+            with daily.route_lock(routeFolder, "NB Main Avenue"):
+                pass
+    finally:
+        holder.kill()
+        holder.wait()
+        holder.stdout.close()
+    with daily.route_lock(routeFolder, "NB Main Avenue"):
+        pass
@@ -0,0 +1,196 @@
+"""
+Checks the local calendar and epoch conversions on the US/Central daylight
+savings nights of 2020: spring forward on 2020-03-08, when 02:00 CST jumps
+to 03:00 CDT at 08:00 UTC, and fall back on 2020-11-01, when 02:00 CDT
+drops back to 01:00 CST at 07:00 UTC.
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import DailyTravelTimeDownload as daily
+import TravelTimeDownload
+
+
+TIME_ZONE = "US/Central"
+SPRING_FORWARD_EPOCH = 1583654400  # 2020-03-08 08:00 UTC
+FALL_BACK_EPOCH = 1604214000  # 2020-11-01 07:00 UTC
+
+
+def local_day(date):
+    """Calendar rows for every bin whose local date is date."""
+    bins = np.arange(
+        (SPRING_FORWARD_EPOCH - 3 * 86400) // daily.BIN_SECONDS,
+        (FALL_BACK_EPOCH + 3 * 86400) // daily.BIN_SECONDS,
+    )
+    calendar = daily.calendar_lookup(bins, TIME_ZONE)
+    calendar["Bin"] = bins
+    return calendar[calendar["Date"] == date]
+
+
+def test_spring_forward_skips_the_two_oclock_hour():
+    day = local_day("2020-03-08")
+    assert len(day) == 92
+    assert not day["Time"].str.startswith("02:").any()
+    assert day["DateTime"].is_unique
+    before = day[day["Bin"] == SPRING_FORWARD_EPOCH // daily.BIN_SECONDS - 1]
+    after = day[day["Bin"] == SPRING_FORWARD_EPOCH // daily.BIN_SECONDS]
+    assert before["DateTime"].item() == "2020-03-08 01:45:00"
+    assert after["DateTime"].item() == "2020-03-08 03:00:00"
+    assert (day["Month"] == "March").all()
+    assert (day["Day"] == "Sunday").all()
+    assert (day["DoW"] == 1).all()
+
+
+def test_fall_back_repeats_the_one_oclock_hour():
+    day = local_day("2020-11-01")
+    assert len(day) == 100
+    counts = day["Time"].value_counts()
+    repeated = sorted(counts[counts == 2].index)
+    assert repeated == ["01:00:00", "01:15:00", "01:30:00", "01:45:00"]
+    firstOne = day[day["Bin"] == (FALL_BACK_EPOCH - 3600) // daily.BIN_SECONDS]
+    secondOne = day[day["Bin"] == FALL_BACK_EPOCH // daily.BIN_SECONDS]
+    assert firstOne["DateTime"].item() == "2020-11-01 01:00:00"
+    assert secondOne["DateTime"].item() == "2020-11-01 01:00:00"
+    assert day["Bin"].is_monotonic_increasing
+
+
+def test_calendar_matches_row_by_row_formatting():
+    bins = np.arange(
+        int(pd.Timestamp("2019-01-01").timestamp()) // daily.BIN_SECONDS,
+        int(pd.Timestamp("2022-01-01").timestamp()) // daily.BIN_SECONDS,
+    )
+    calendar = daily.calendar_lookup(bins, TIME_ZONE)
+    local = (
+        pd.Series(pd.to_datetime(bins * daily.BIN_SECONDS, unit="s"))
+        .dt.tz_localize("utc")
+        .dt.tz_convert(TIME_ZONE)
+        .apply("{:%B %A %w %Y-%m-%d %H:%M:%S}".format)
+        .str.split(" ", expand=True)
+    )
+    assert (calendar["Month"].values == local[0].values).all()
+    assert (calendar["Day"].values == local[1].values).all()
+    assert (calendar["DoW"].values == local[2].astype(int).values + 1).all()
+    assert (calendar["Date"].values == local[3].values).all()
+    assert (calendar["Time"].values == local[4].values).all()
+
+
+def test_local_to_epoch_on_transition_nights():
+    assert daily.local_to_epoch(datetime(2020, 3, 8, 1, 45), TIME_ZONE) == (
+        SPRING_FORWARD_EPOCH - 900
+    )
+    assert daily.local_to_epoch(datetime(2020, 3, 8, 3, 0), TIME_ZONE) == (
+        SPRING_FORWARD_EPOCH
+    )
+    assert daily.local_to_epoch(datetime(2020, 3, 8, 2, 30), TIME_ZONE) == (
+        SPRING_FORWARD_EPOCH
+    )
+    assert daily.local_to_epoch(datetime(2020, 11, 1, 1, 45), TIME_ZONE) == (
+        FALL_BACK_EPOCH + 2700
+    )
+    spring = daily.local_to_epoch(datetime(2020, 3, 9), TIME_ZONE)
+    spring -= daily.local_to_epoch(datetime(2020, 3, 8), TIME_ZONE)
+    fall = daily.local_to_epoch(datetime(2020, 11, 2), TIME_ZONE)
+    fall -= daily.local_to_epoch(datetime(2020, 11, 1), TIME_ZONE)
+    assert spring == 23 * 3600
+    assert fall == 25 * 3600
+
+
+def fixed_now(now):
+    """A datetime class whose now() is the given local time."""
+
+    class FixedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now.replace(tzinfo=tz)
+
+    return FixedDatetime
+
+
+def test_calc_time_interval_over_spring_forward(monkeypatch):
+    monkeypatch.setattr(daily, "datetime", fixed_now(datetime(2020, 3, 9, 2)))
+    fromDateEpoch, toDate, toDateEpoch = daily.calc_time_interval(
+        datetime(2020, 3, 7, 23, 45), TIME_ZONE
+    )
+    assert fromDateEpoch == SPRING_FORWARD_EPOCH - 2 * 3600
+    assert toDate == datetime(2020, 3, 9)
+    assert toDateEpoch - fromDateEpoch == 23 * 3600
+
+
+def test_calc_time_interval_over_fall_back(monkeypatch):
+    monkeypatch.setattr(daily, "datetime", fixed_now(datetime(2020, 11, 2, 2)))
+    fromDateEpoch, toDate, toDateEpoch = daily.calc_time_interval(
+        datetime(2020, 11, 1, 0, 45), TIME_ZONE
+    )
+    assert fromDateEpoch == FALL_BACK_EPOCH - 3600
+    assert toDate == datetime(2020, 11, 2)
+    assert toDateEpoch - fromDateEpoch == 24 * 3600
+
+
+def test_compact_from_master_drops_unmatched_times():
+    df = pd.DataFrame(
+        {
+            "DateTime": [
+                "2020-03-08 01:45:00",
+                "2020-03-08 02:15:00",
+                "2020-11-01 01:00:00",
+                "2020-11-01 01:00:00",
+                "2020-11-01 01:00:00",
+            ],
+        }
+    )
+    df["Date"] = df["DateTime"].str[:10]
+    for column in daily.TRAVEL_TIMES:
+        df[column] = "00:10:00"
+    compact = daily.compact_from_master(df, TIME_ZONE)
+    assert compact["Bin"].tolist() == [
+        SPRING_FORWARD_EPOCH // daily.BIN_SECONDS - 1,
+        (FALL_BACK_EPOCH - 3600) // daily.BIN_SECONDS,
+        FALL_BACK_EPOCH // daily.BIN_SECONDS,
+    ]
+    calendar = daily.calendar_lookup(compact["Bin"], TIME_ZONE)
+    assert calendar["Date"].tolist() == ["2020-03-08"] + ["2020-11-01"] * 2
+
+
+def download_windows(monkeypatch, startDate, endDate):
+    """The (start, end) epochs TravelTimeDownload requests for a date range."""
+    monkeypatch.setattr(
+        TravelTimeDownload,
+        "user_date_input",
+        lambda: (
+            startDate,
+            endDate,
+            str(startDate.date()),
+            str(endDate.date()),
+        ),
+    )
+    dayEpochs, days, _, _ = TravelTimeDownload.start_end_times(TIME_ZONE)
+    urls = []
+    monkeypatch.setattr(
+        TravelTimeDownload.urllib.request,
+        "urlretrieve",
+        lambda url, fileName: urls.append(url),
+    )
+    TravelTimeDownload.download_files("Downloads", dayEpochs, "base", "1", "R")
+    assert len(urls) == days
+    return [tuple(int(x) for x in url.split("/")[2:4]) for url in urls]
+
+
+def test_download_days_over_spring_forward(monkeypatch):
+    windows = download_windows(
+        monkeypatch, datetime(2020, 3, 7), datetime(2020, 3, 9)
+    )
+    assert [end - start for start, end in windows] == [86400, 82800, 86400]
+    assert windows[1][0] == daily.local_to_epoch(datetime(2020, 3, 8))
+    assert windows[-1][1] == daily.local_to_epoch(datetime(2020, 3, 10))
+
+
+def test_download_days_over_fall_back(monkeypatch):
+    windows = download_windows(
+        monkeypatch, datetime(2020, 10, 31), datetime(2020, 11, 1)
+    )
+    assert [end - start for start, end in windows] == [86400, 90000]
+    assert windows[-1][1] == daily.local_to_epoch(datetime(2020, 11, 2))
+    assert windows[0][1] == windows[1][0]
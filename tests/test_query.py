@@ -0,0 +1,119 @@
+"""
+Checks query() against a brute force pandas groupby of the same rows, for a
+date range made of whole months, answered from the summaries, and partial
+months, answered from the 15 minute rows.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import DailyTravelTimeDownload as daily
+import TravelTimeQuery
+
+
+TIME_ZONE = "US/Central"
+ROUTES = ["NB Main Avenue", "SB Main Avenue"]
+START, END = "2020-01-25", "2020-04-05"
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    """Query store of three routes from mid January to mid April 2020."""
+    queryFolder = str(tmp_path_factory.mktemp("Query"))
+    firstBin = int(pd.Timestamp("2020-01-15 06:00").timestamp()) // 900
+    lastBin = int(pd.Timestamp("2020-04-15 05:00").timestamp()) // 900
+    bins = np.arange(firstBin, lastBin)
+    randomState = np.random.RandomState(0)
+    frames = []
+    for routeName in ROUTES + ["EB Other Street"]:
+        travelTimes = {}
+        for column in daily.TRAVEL_TIMES:
+            seconds = randomState.randint(120, 1800, len(bins)).astype(float)
+            seconds[randomState.rand(len(bins)) < 0.1] = np.nan
+            travelTimes[column] = seconds
+        compact = daily.compact_rows(bins, travelTimes)
+        frames.append(daily.query_rows(routeName, compact, TIME_ZONE))
+    daily.store_query_rows(frames, queryFolder)
+    return queryFolder, pd.concat(frames, ignore_index=True)
+
+
+def brute_force(rows, agg, by, dow=None, timeRange=None):
+    """Filters and aggregates the stored rows directly."""
+    keep = (
+        rows["Route"].isin(ROUTES)
+        & (rows["Date"] >= TravelTimeQuery.date_key(START))
+        & (rows["Date"] <= TravelTimeQuery.date_key(END))
+    )
+    if dow is not None:
+        keep &= rows["DoW"].isin(dow)
+    if timeRange is not None:
+        keep &= rows["Slot"] >= TravelTimeQuery.slot_key(timeRange[0])
+        keep &= rows["Slot"] < TravelTimeQuery.slot_key(timeRange[1])
+    rows = rows[keep]
+    grouped = rows.groupby(["Route"] + by, sort=True)[daily.TRAVEL_TIMES]
+    return grouped.agg(agg).astype(np.float64)
+
+
+@pytest.mark.parametrize("agg", ["mean", "sum", "count", "median"])
+@pytest.mark.parametrize("by", [[], ["DoW"], ["Slot"], ["Date"]])
+@pytest.mark.parametrize(
+    "dow, timeRange",
+    [(None, None), ([2, 3, 4, 5, 6], ("07:00", "09:00"))],
+)
+def test_query_matches_brute_force(store, monkeypatch, agg, by, dow, timeRange):
+    queryFolder, rows = store
+    readFiles = []
+    readStoreFile = TravelTimeQuery.read_store_file
+
+    def spy(storeFile, routes, columns):
+        readFiles.append(storeFile)
+        return readStoreFile(storeFile, routes, columns)
+
+    monkeypatch.setattr(TravelTimeQuery, "read_store_file", spy)
+    result = TravelTimeQuery.query(
+        ROUTES,
+        START,
+        END,
+        dow=dow,
+        timeRange=timeRange,
+        agg=agg,
+        by=by,
+        queryFolder=queryFolder,
+    )
+    expected = brute_force(rows, agg, by, dow, timeRange)
+    assert list(result.index) == list(expected.index)
+    np.testing.assert_allclose(
+        result[daily.TRAVEL_TIMES].values.astype(np.float64),
+        expected.values,
+        rtol=1e-6,
+    )
+    summaryFiles = [f for f in readFiles if "Summary" in f]
+    if agg in ("mean", "sum", "count") and by != ["Date"]:
+        assert len(summaryFiles) == 2
+        assert len(readFiles) == 4
+    else:
+        assert not summaryFiles
+        assert len(readFiles) == 4
+
+
+def test_query_rows_without_aggregation(store):
+    queryFolder, rows = store
+    result = TravelTimeQuery.query(
+        ROUTES[0],
+        START,
+        END,
+        dow=[1],
+        timeRange=("23:00", "24:00"),
+        agg=None,
+        queryFolder=queryFolder,
+    )
+    expected = rows[
+        (rows["Route"] == ROUTES[0])
+        & (rows["Date"] >= 20200125)
+        & (rows["Date"] <= 20200405)
+        & (rows["DoW"] == 1)
+        & (rows["Slot"] >= 92)
+    ]
+    assert result["Bin"].tolist() == expected["Bin"].tolist()
+    assert len(result) == 11 * 4
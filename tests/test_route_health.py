@@ -0,0 +1,130 @@
+"""
+Checks the health check's coverage, gap runs and outliers against a known
+baseline, and the baselines built from the query store summaries.
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import DailyTravelTimeDownload as daily
+
+
+TIME_ZONE = "US/Central"
+MONDAY = 2  # DoW of 2020-06-01
+
+
+def day_bins(date):
+    """The 96 bins of a local day without a time change."""
+    firstBin = daily.local_to_epoch(date, TIME_ZONE) // daily.BIN_SECONDS
+    return np.arange(firstBin, firstBin + 96)
+
+
+def health_compact(seconds):
+    """Compact rows for 2020-06-01 with HEALTH_COLUMN set to seconds."""
+    travelTimes = {column: seconds for column in daily.TRAVEL_TIMES}
+    return daily.compact_rows(day_bins(datetime(2020, 6, 1)), travelTimes)
+
+
+def flat_baseline(mean=600.0, std=60.0):
+    """A baseline of mean and std for every day of the week and period."""
+    return np.full(8 * 96, mean), np.full(8 * 96, std)
+
+
+def test_gap_runs_and_coverage():
+    seconds = np.full(96, 600.0)
+    seconds[[0, 1, 2]] = np.nan  # leading
+    seconds[10:15] = np.nan  # interior, longest
+    seconds[50] = np.nan  # interior, single period
+    seconds[93:] = np.nan  # trailing
+    report = daily.route_health(
+        health_compact(seconds), *flat_baseline(), TIME_ZONE
+    )
+    assert report["From"] == "2020-06-01 00:00:00"
+    assert report["To"] == "2020-06-01 23:45:00"
+    assert report["Periods"] == 96
+    assert report["Coverage"] == round(1 - 12 / 96, 3)
+    assert report["Gaps"] == 4
+    assert report["Longest Gap"] == 5
+    assert report["Outliers"] == 0
+    assert report["Max Z"] == 0.0
+
+
+def test_no_data_is_one_gap():
+    report = daily.route_health(
+        health_compact(np.full(96, np.nan)), *flat_baseline(), TIME_ZONE
+    )
+    assert report["Coverage"] == 0.0
+    assert report["Gaps"] == 1
+    assert report["Longest Gap"] == 96
+    assert report["Outliers"] == 0
+
+
+def test_outliers_against_baseline():
+    mean, std = flat_baseline()
+    mean[MONDAY * 96 + 30] = np.nan  # too little data for a baseline
+    std[MONDAY * 96 + 30] = np.nan
+    seconds = np.full(96, 600.0)
+    seconds[20] = 840.0  # z = 4
+    seconds[21] = 780.0  # z = 3, not above OUTLIER_Z
+    seconds[22] = 300.0  # z = 5 below the mean
+    seconds[30] = 5000.0  # no baseline, ignored
+    seconds[40] = np.nan
+    report = daily.route_health(health_compact(seconds), mean, std, TIME_ZONE)
+    assert report["Outliers"] == 2
+    assert report["Max Z"] == 5.0
+    assert report["Gaps"] == 1
+
+
+def test_baselines_from_summaries(tmp_path):
+    queryFolder = str(tmp_path)
+    frames = []
+    randomState = np.random.RandomState(0)
+    mondays = [datetime(2020, 5, d) for d in (4, 11, 18, 25)]
+    for routeName, days in [("NB Main Avenue", mondays), ("SB", mondays[:3])]:
+        for date in days:
+            seconds = 600 + randomState.randint(-60, 60, 96).astype(float)
+            travelTimes = {column: seconds for column in daily.TRAVEL_TIMES}
+            compact = daily.compact_rows(day_bins(date), travelTimes)
+            frames.append(daily.query_rows(routeName, compact, TIME_ZONE))
+    daily.store_query_rows(frames, queryFolder)
+    rows = pd.concat(frames, ignore_index=True)
+    baselines = daily.route_baselines(
+        ["NB Main Avenue", "SB", "Unknown"], 202006, queryFolder
+    )
+    mean, std = baselines["NB Main Avenue"]
+    nb = rows[rows["Route"] == "NB Main Avenue"].groupby("Slot")["Strengths"]
+    keys = MONDAY * 96 + np.arange(96)
+    np.testing.assert_allclose(mean[keys], nb.mean().values)
+    np.testing.assert_allclose(std[keys], nb.std(ddof=0).values, atol=1e-6)
+    otherKeys = np.setdiff1d(np.arange(8 * 96), keys)
+    assert np.isnan(mean[otherKeys]).all()
+    # Three Mondays are fewer than BASELINE_MIN_COUNT
+    assert np.isnan(baselines["SB"][0]).all()
+    assert np.isnan(baselines["Unknown"][0]).all()
+    # Months after lastMonth are left out
+    before = daily.route_baselines(["NB Main Avenue"], 202004, queryFolder)
+    assert np.isnan(before["NB Main Avenue"][0]).all()
+
+
+def test_health_report_is_written_once_per_window(tmp_path):
+    routeFolder = str(tmp_path)
+    compact = health_compact(np.full(96, 600.0))
+    for _ in range(2):
+        daily.check_route_health(
+            "NB Main Avenue", routeFolder, compact, flat_baseline(), TIME_ZONE
+        )
+    health = pd.read_csv(tmp_path / "NB Main Avenue - Health.csv")
+    assert list(health.columns) == [
+        "Checked",
+        "From",
+        "To",
+        "Periods",
+        "Coverage",
+        "Gaps",
+        "Longest Gap",
+        "Outliers",
+        "Max Z",
+    ]
+    assert len(health) == 1